@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Measures how much time pyechonest itself spends per API call: param encoding, response decoding,
+util.fix, object hydration, analysis parsing and paginated iteration. Responses are recorded once
+from a local mockserver.MockServer, so the numbers do not depend on the network or on the real API.
+The end-to-end benchmarks call the mock server over loopback.
+
+Results are written as JSON so they can be kept per release and compared:
+
+    python benchmarks/bench_client.py --output 9.0.0.json
+    python benchmarks/bench_client.py --compare 9.0.0.json
+
+Allocations are counted with tracemalloc where it is available; otherwise the net number of new
+gc-tracked objects per operation is reported instead.
+"""
+try:
+    import json
+except ImportError:
+    import simplejson as json
+import gc
+import optparse
+import os
+import platform
+import StringIO
+import sys
+import time
+import timeit
+import urllib
+import urllib2
+
+# benchmark the working tree rather than an installed copy
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from pyechonest import config, util, mockserver, song, artist
+from pyechonest.proxies import ResultList
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def _allocations(func, inner):
+    """Allocations for one operation, and what they were counted with"""
+    if tracemalloc is not None:
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        for i in xrange(inner):
+            func()
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename') if stat.count_diff > 0)
+        return float(blocks) / inner, 'tracemalloc_blocks'
+    gc.collect()
+    gc.disable()
+    try:
+        before = len(gc.get_objects())
+        results = [func() for i in xrange(inner)]
+        after = len(gc.get_objects())
+    finally:
+        gc.enable()
+    del results
+    return float(after - before - 1) / inner, 'gc_objects'
+
+def run_benchmark(name, func, inner=1, min_time=1.0, min_samples=20):
+    """
+    Call func in batches of inner calls until min_time seconds and min_samples batches have passed,
+    and summarize the per-call times
+    """
+    func()
+    samples = []
+    deadline = timeit.default_timer() + min_time
+    while len(samples) < min_samples or timeit.default_timer() < deadline:
+        start = timeit.default_timer()
+        for i in xrange(inner):
+            func()
+        samples.append((timeit.default_timer() - start) / inner)
+    samples.sort()
+    allocations, allocation_kind = _allocations(func, inner)
+    ops = len(samples) * inner
+    total = sum(samples) * inner
+    return {
+        'name': name,
+        'ops': ops,
+        'seconds': total,
+        'ops_per_sec': ops / total if total else None,
+        'mean_us': total / ops * 1e6,
+        'p50_us': _percentile(samples, .5) * 1e6,
+        'p90_us': _percentile(samples, .9) * 1e6,
+        'p99_us': _percentile(samples, .99) * 1e6,
+        'max_us': samples[-1] * 1e6,
+        'allocations_per_op': allocations,
+        'allocation_kind': allocation_kind,
+    }
+
+def _record(method, params):
+    url = 'http://%s/%s/%s/%s?%s' % (config.API_HOST, config.API_SELECTOR, config.API_VERSION, method,
+                                     urllib.urlencode(util.encode_params(params)))
+    return urllib2.urlopen(url).read()
+
+def _upload_track():
+    response = util.callm('track/upload', {'url': 'http://example.com/bench.mp3', 'bucket': 'audio_summary'},
+                          POST=True)
+    return response['response']['track']['audio_summary']['analysis_url']
+
+def build_benchmarks():
+    """A list of (name, func, inner) tuples; needs config.API_HOST pointed at a mock server"""
+    buckets = ['audio_summary', 'song_hotttnesss', 'artist_familiarity', 'artist_hotttnesss']
+    search_params = {'artist': 'radiohead', 'title': u'karma police – live', 'results': 100, 'bucket': buckets,
+                     'min_tempo': 120, 'max_loudness': -5, 'sort': 'tempo-asc', 'api_key': 'BENCHMARK'}
+    raw_songs = _record('song/search', search_params)
+    raw_artist = _record('artist/profile', {'name': 'radiohead', 'bucket': ['familiarity', 'hotttnesss', 'terms']})
+    raw_analysis = urllib2.urlopen(_upload_track()).read()
+    songs = util.json_loads(raw_songs)['response']['songs']
+    song_dict = songs[0]
+    unicode_keyed = dict((unicode(k), v) for (k, v) in song_dict.iteritems())
+
+    pages = {}
+    def fetch(start, results):
+        if (start, results) not in pages:
+            pages[(start, results)] = util.json_loads(_record('artist/songs', {'name': 'radiohead', 'start': start,
+                                                                              'results': results}))['response']
+        response = pages[(start, results)]
+        return ResultList(response['songs'], start, response['total'])
+    list(util.paginate(fetch, page_size=15, prefetch=0))
+
+    return [
+        ('encode_params', lambda: urllib.urlencode(util.encode_params(dict(search_params))), 200),
+        ('decode_response_100_songs', lambda: util.get_successful_response(StringIO.StringIO(raw_songs)), 5),
+        ('decode_response_artist', lambda: util.get_successful_response(StringIO.StringIO(raw_artist)), 50),
+        ('fix_unicode_keys', lambda: util.fix(unicode_keyed), 500),
+        ('hydrate_100_songs', lambda: [song.Song.from_response(d) for d in songs], 5),
+        ('hydrate_100_song_records', lambda: [song.SongRecord.from_response(d) for d in songs], 5),
+        ('parse_analysis', lambda: util.json_loads(raw_analysis), 1),
+        ('paginate_50_songs', lambda: list(util.paginate(fetch, page_size=15, prefetch=0)), 20),
+        ('paginate_50_songs_prefetch', lambda: list(util.paginate(fetch, page_size=15, prefetch=1)), 5),
+        ('callm_artist_profile_loopback', lambda: util.callm('artist/profile', {'name': 'radiohead'}), 1),
+        ('song_search_100_loopback', lambda: song.search(artist='radiohead', results=100, buckets=buckets), 1),
+        ('iter_songs_loopback', lambda: list(artist.Artist('radiohead').iter_songs(page_size=15, cache=False)), 1),
+    ]
+
+def compare(results, baseline):
+    """Print the change in mean time per operation against an earlier results file"""
+    before = dict((r['name'], r) for r in baseline['results'])
+    for r in results['results']:
+        old = before.get(r['name'])
+        if old is None:
+            print '%-32s %10.1fus  (new)' % (r['name'], r['mean_us'])
+        else:
+            change = (r['mean_us'] - old['mean_us']) / old['mean_us'] * 100
+            print '%-32s %10.1fus  %+6.1f%%' % (r['name'], r['mean_us'], change)
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option('--output', help="write the results as JSON to this file ('-' for stdout)")
+    parser.add_option('--compare', help="a results file from an earlier run to compare against")
+    parser.add_option('--filter', default='', help="only run benchmarks whose names contain this")
+    parser.add_option('--min-time', type='float', default=1.0, help="seconds to spend on each benchmark")
+    parser.add_option('--json-backend', default=None, help="ujson, simplejson or json")
+    options, args = parser.parse_args(argv)
+
+    if options.json_backend:
+        util.set_json_backend(options.json_backend)
+    config.ECHO_NEST_API_KEY = config.ECHO_NEST_API_KEY or 'BENCHMARK'
+    results = []
+    with mockserver.MockServer(pending_polls=0):
+        for name, func, inner in build_benchmarks():
+            if options.filter in name:
+                r = run_benchmark(name, func, inner, options.min_time)
+                results.append(r)
+                print >> sys.stderr, '%-32s %12.0f ops/s  p50 %9.1fus  p99 %9.1fus  %8.1f allocs/op' % (
+                    name, r['ops_per_sec'], r['p50_us'], r['p99_us'], r['allocations_per_op'])
+
+    report = {
+        'pyechonest': config.__version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'json_backend': util.get_json_backend(),
+        'timestamp': int(time.time()),
+        'results': results,
+    }
+    if options.output == '-':
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    elif options.output:
+        f = open(options.output, 'w')
+        try:
+            json.dump(report, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+    if options.compare:
+        compare(report, json.load(open(options.compare)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Measures how long importing pyechonest takes, in a fresh interpreter for every run, and checks
+that the optional or slow pieces (pkg_resources, oauth2, the alternative JSON backends) are not
+loaded until they are used. Exits with status 1 if an import is slower than --max-ms or pulls in
+one of them, so it can guard against regressions in CI:
+
+    python benchmarks/bench_import.py --max-ms 150
+    python benchmarks/bench_import.py --output 9.0.0-import.json
+"""
+try:
+    import json
+except ImportError:
+    import simplejson as json
+import optparse
+import os
+import platform
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+MODULES = ('config', 'util', 'proxies', 'artist', 'song', 'track', 'playlist', 'catalog', 'client')
+"""The pyechonest modules timed, each on its own"""
+
+LAZY_MODULES = ('pkg_resources', 'oauth2', 'ujson', 'simplejson')
+"""Modules that importing pyechonest must not load"""
+
+# run in the child: time one import and report what it loaded
+_PROBE = """
+import sys, time
+sys.path.insert(0, %(root)r)
+before = set(sys.modules)
+start = time.time()
+import %(module)s
+elapsed = time.time() - start
+loaded = [m for m in set(sys.modules) - before if sys.modules[m] is not None]
+sys.stdout.write('%%r %%s' %% (elapsed, ' '.join(sorted(loaded))))
+"""
+
+def time_import(module, runs):
+    """Import times (seconds) of module over runs fresh interpreters, and the modules it loaded"""
+    times = []
+    loaded = set()
+    for i in xrange(runs):
+        probe = _PROBE % {'root': os.path.abspath(ROOT), 'module': module}
+        output = subprocess.Popen([sys.executable, '-c', probe], stdout=subprocess.PIPE).communicate()[0]
+        elapsed, names = (output.split(' ', 1) + [''])[:2]
+        times.append(float(elapsed))
+        loaded.update(names.split())
+    return sorted(times), loaded
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option('--runs', type='int', default=10, help="fresh interpreters per module")
+    parser.add_option('--max-ms', type='float', default=None, help="fail if a median import takes longer")
+    parser.add_option('--output', help="write the results as JSON to this file ('-' for stdout)")
+    options, args = parser.parse_args(argv)
+
+    results = []
+    failed = False
+    for name in ('pyechonest.' + m for m in MODULES):
+        times, loaded = time_import(name, options.runs)
+        median_ms = times[len(times) // 2] * 1000
+        eager = sorted(m for m in loaded if m.split('.')[0] in LAZY_MODULES)
+        slow = options.max_ms is not None and median_ms > options.max_ms
+        failed = failed or slow or bool(eager)
+        results.append({'name': name, 'min_ms': times[0] * 1000, 'median_ms': median_ms,
+                        'modules_loaded': len(loaded), 'eager': eager})
+        print >> sys.stderr, '%-24s min %7.1fms  median %7.1fms  %4d modules%s%s' % (
+            name, times[0] * 1000, median_ms, len(loaded),
+            '  SLOW' if slow else '', '  loads ' + ', '.join(eager) if eager else '')
+
+    report = {'python': platform.python_version(), 'implementation': platform.python_implementation(),
+              'runs': options.runs, 'results': results}
+    if options.output == '-':
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    elif options.output:
+        f = open(options.output, 'w')
+        try:
+            json.dump(report, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
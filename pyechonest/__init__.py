@@ -6,4 +6,4 @@ Copyright (c) 2010 The Echo Nest. All rights reserved.
 Created by Tyler Williams on 2009-06-25.
 """
 
-__all__ = ['config', 'util', 'proxies', 'artist', 'catalog', 'song', 'track', 'playlist']
+__all__ = ['config', 'util', 'proxies', 'artist', 'catalog', 'song', 'track', 'playlist', 'graph', 'songframe', 'client']
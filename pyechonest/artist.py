@@ -8,6 +8,10 @@ Created by Tyler Williams on 2010-04-25.
 The Artist module loosely covers http://developer.echonest.com/docs/v4/artist.html
 Refer to the official api documentation if you are unsure about something.
 """
+import bisect
+import collections
+import threading
+
 import util
 from proxies import ArtistProxy, ResultList
 from song import Song
@@ -120,12 +124,26 @@ class Artist(ArtistProxy):
         if cache and ('audio' in self.cache) and results==15 and start==0:
             return self.cache['audio']
         else:
-            response = self.get_attribute('audio', results=results, start=start)
-            if results==15 and start==0:
-                self.cache['audio'] = ResultList(response['audio'], 0, response['total'])
+            response = self.get_cached_attribute(cache, 'audio', results=results, start=start)
             return ResultList(response['audio'], start, response['total'])
     
     audio = property(get_audio)
+
+    def iter_audio(self, page_size=15, start=0, prefetch=1, cache=True):
+        """Iterate over all of an artist's audio document dicts, fetching page_size at a time
+        
+        Kwargs:
+            page_size (int): The number of results to fetch per API call
+            
+            start (int): An integer starting value for the result set
+            
+            prefetch (int): The number of pages to fetch ahead of the one being read, concurrently
+        
+        Returns:
+            A generator of audio document dicts
+        """
+        return util.paginate(lambda s, r: self.get_audio(results=r, start=s, cache=cache),
+                             page_size, start, prefetch)
     
     def get_biographies(self, results=15, start=0, license=None, cache=True):
         """Get a list of artist biographies
@@ -155,12 +173,26 @@ class Artist(ArtistProxy):
         if cache and ('biographies' in self.cache) and results==15 and start==0 and license==None:
             return self.cache['biographies']
         else:
-            response = self.get_attribute('biographies', results=results, start=start, license=license)
-            if results==15 and start==0 and license==None:
-                self.cache['biographies'] = ResultList(response['biographies'], 0, response['total'])
+            response = self.get_cached_attribute(cache, 'biographies', results=results, start=start, license=license)
             return ResultList(response['biographies'], start, response['total'])
     
     biographies = property(get_biographies)    
+
+    def iter_biographies(self, page_size=15, start=0, prefetch=1, license=None, cache=True):
+        """Iterate over all of an artist's biography document dicts, fetching page_size at a time
+        
+        Kwargs:
+            page_size (int): The number of results to fetch per API call
+            
+            start (int): An integer starting value for the result set
+            
+            prefetch (int): The number of pages to fetch ahead of the one being read, concurrently
+        
+        Returns:
+            A generator of biography document dicts
+        """
+        return util.paginate(lambda s, r: self.get_biographies(results=r, start=s, license=license, cache=cache),
+                             page_size, start, prefetch)
     
     def get_blogs(self, results=15, start=0, cache=True, high_relevance=False):
         """Get a list of blog articles related to an artist
@@ -196,12 +228,26 @@ class Artist(ArtistProxy):
             return self.cache['blogs']
         else:
             high_relevance = 'true' if high_relevance else 'false'
-            response = self.get_attribute('blogs', results=results, start=start, high_relevance=high_relevance)
-            if results==15 and start==0:
-                self.cache['blogs'] = ResultList(response['blogs'], 0, response['total'])
+            response = self.get_cached_attribute(cache, 'blogs', results=results, start=start, high_relevance=high_relevance)
             return ResultList(response['blogs'], start, response['total'])
     
     blogs = property(get_blogs)
+
+    def iter_blogs(self, page_size=15, start=0, prefetch=1, high_relevance=False, cache=True):
+        """Iterate over all of an artist's blog document dicts, fetching page_size at a time
+        
+        Kwargs:
+            page_size (int): The number of results to fetch per API call
+            
+            start (int): An integer starting value for the result set
+            
+            prefetch (int): The number of pages to fetch ahead of the one being read, concurrently
+        
+        Returns:
+            A generator of blog document dicts
+        """
+        return util.paginate(lambda s, r: self.get_blogs(results=r, start=s, high_relevance=high_relevance, cache=cache),
+                             page_size, start, prefetch)
        
     def get_familiarity(self, cache=True):
         """Get our numerical estimation of how familiar an artist currently is to the world
@@ -334,14 +380,28 @@ class Artist(ArtistProxy):
         if cache and ('images' in self.cache) and results==15 and start==0 and license==None:
             return self.cache['images']
         else:
-            response = self.get_attribute('images', results=results, start=start, license=license)
+            response = self.get_cached_attribute(cache, 'images', results=results, start=start, license=license)
             total = response.get('total') or 0
-            if results==15 and start==0 and license==None:
-                self.cache['images'] = ResultList(response['images'], 0, total)
             return ResultList(response['images'], start, total)
     
     images = property(get_images)    
 
+    def iter_images(self, page_size=15, start=0, prefetch=1, license=None, cache=True):
+        """Iterate over all of an artist's image document dicts, fetching page_size at a time
+        
+        Kwargs:
+            page_size (int): The number of results to fetch per API call
+            
+            start (int): An integer starting value for the result set
+            
+            prefetch (int): The number of pages to fetch ahead of the one being read, concurrently
+        
+        Returns:
+            A generator of image document dicts
+        """
+        return util.paginate(lambda s, r: self.get_images(results=r, start=s, license=license, cache=cache),
+                             page_size, start, prefetch)
+
     def get_news(self, results=15, start=0, cache=True, high_relevance=False):
         """Get a list of news articles found on the web related to an artist
         
@@ -369,12 +429,26 @@ class Artist(ArtistProxy):
             return self.cache['news']
         else:
             high_relevance = 'true' if high_relevance else 'false'
-            response = self.get_attribute('news', results=results, start=start, high_relevance=high_relevance)
-            if results==15 and start==0:
-                self.cache['news'] = ResultList(response['news'], 0, response['total'])
+            response = self.get_cached_attribute(cache, 'news', results=results, start=start, high_relevance=high_relevance)
             return ResultList(response['news'], start, response['total'])
     
     news = property(get_news)
+
+    def iter_news(self, page_size=15, start=0, prefetch=1, high_relevance=False, cache=True):
+        """Iterate over all of an artist's news document dicts, fetching page_size at a time
+        
+        Kwargs:
+            page_size (int): The number of results to fetch per API call
+            
+            start (int): An integer starting value for the result set
+            
+            prefetch (int): The number of pages to fetch ahead of the one being read, concurrently
+        
+        Returns:
+            A generator of news document dicts
+        """
+        return util.paginate(lambda s, r: self.get_news(results=r, start=s, high_relevance=high_relevance, cache=cache),
+                             page_size, start, prefetch)
     
     def get_reviews(self, results=15, start=0, cache=True):
         """Get reviews related to an artist's work
@@ -407,12 +481,26 @@ class Artist(ArtistProxy):
         if cache and ('reviews' in self.cache) and results==15 and start==0:
             return self.cache['reviews']
         else:
-            response = self.get_attribute('reviews', results=results, start=start)
-            if results==15 and start==0:
-                self.cache['reviews'] = ResultList(response['reviews'], 0, response['total'])
+            response = self.get_cached_attribute(cache, 'reviews', results=results, start=start)
             return ResultList(response['reviews'], start, response['total'])
     
     reviews = property(get_reviews)
+
+    def iter_reviews(self, page_size=15, start=0, prefetch=1, cache=True):
+        """Iterate over all of an artist's review document dicts, fetching page_size at a time
+        
+        Kwargs:
+            page_size (int): The number of results to fetch per API call
+            
+            start (int): An integer starting value for the result set
+            
+            prefetch (int): The number of pages to fetch ahead of the one being read, concurrently
+        
+        Returns:
+            A generator of review document dicts
+        """
+        return util.paginate(lambda s, r: self.get_reviews(results=r, start=s, cache=cache),
+                             page_size, start, prefetch)
     
     def get_similar(self, results=15, start=0, buckets=None, limit=False, cache=True, max_familiarity=None, min_familiarity=None, \
                     max_hotttnesss=None, min_hotttnesss=None, min_results=None, reverse=False, artist_start_year_before=None, \
@@ -478,14 +566,36 @@ class Artist(ArtistProxy):
         
         
         if cache and ('similar' in self.cache) and results==15 and start==0 and (not kwargs):
-            return [Artist(**util.fix(a)) for a in self.cache['similar']]
+            return [Artist.from_response(a) for a in self.cache['similar']]
         else:
-            response = self.get_attribute('similar', results=results, start=start, **kwargs)
-            if results==15 and start==0 and (not kwargs):
-                self.cache['similar'] = response['artists']
-            return [Artist(**util.fix(a)) for a in response['artists']]
+            response = self.get_cached_attribute(cache, 'similar', results=results, start=start, **kwargs)
+            return [Artist.from_response(a) for a in response['artists']]
     
     similar = property(get_similar)    
+
+    def iter_similar(self, page_size=15, start=0, prefetch=1, cache=True, max_results=100, **kwargs):
+        """Iterate over artists similar to this one, fetching page_size at a time
+        
+        Kwargs:
+            page_size (int): The number of results to fetch per API call
+            
+            start (int): An integer starting value for the result set
+            
+            prefetch (int): The number of pages to fetch ahead of the one being read, concurrently
+            
+            max_results (int): Where to stop; artist/similar gives no total, and serves at most 100
+            
+            All other kwargs (buckets, limit, max_familiarity, ...) are the same as for get_similar.
+        
+        Returns:
+            A generator of Artist objects
+        """
+        def fetch(s, r):
+            r = min(r, max_results - s)
+            if r <= 0:
+                return ResultList([], s, max_results)
+            return ResultList(self.get_similar(results=r, start=s, cache=cache, **kwargs), s, max_results)
+        return util.paginate(fetch, page_size, start, prefetch)
     
     def get_songs(self, cache=True, results=15, start=0):
         """Get the songs associated with an artist
@@ -521,16 +631,30 @@ class Artist(ArtistProxy):
                 self.cache['songs'] = song_objects
             return self.cache['songs']
         else:
-            response = self.get_attribute('songs', results=results, start=start)
+            response = self.get_cached_attribute(cache, 'songs', results=results, start=start)
             for s in response['songs']:
                 s.update({'artist_id':self.id, 'artist_name':self.name})
-            songs = [Song(**util.fix(s)) for s in response['songs']]
-            if results==15 and start==0:
-                self.cache['songs'] = ResultList(songs, 0, response['total'])
+            songs = [Song.from_response(s) for s in response['songs']]
             return ResultList(songs, start, response['total'])
     
     songs = property(get_songs)
 
+    def iter_songs(self, page_size=15, start=0, prefetch=1, cache=True):
+        """Iterate over all of an artist's Song objects, fetching page_size at a time
+        
+        Kwargs:
+            page_size (int): The number of results to fetch per API call
+            
+            start (int): An integer starting value for the result set
+            
+            prefetch (int): The number of pages to fetch ahead of the one being read, concurrently
+        
+        Returns:
+            A generator of Song objects
+        """
+        return util.paginate(lambda s, r: self.get_songs(results=r, start=s, cache=cache),
+                             page_size, start, prefetch)
+
     def get_terms(self, sort='weight', cache=True):
         """Get the terms associated with an artist
         
@@ -585,9 +709,7 @@ class Artist(ArtistProxy):
         if cache and ('terms' in self.cache) and sort=='weight':
             return self.cache['terms']
         else:
-            response = self.get_attribute('terms', sort=sort)
-            if sort=='weight':
-                self.cache['terms'] = response['terms']
+            response = self.get_cached_attribute(cache, 'terms', sort=sort)
             return response['terms']
     
     terms = property(get_terms)
@@ -654,13 +776,27 @@ class Artist(ArtistProxy):
         if cache and ('video' in self.cache) and results==15 and start==0:
             return self.cache['video']
         else:
-            response = self.get_attribute('video', results=results, start=start)
-            if results==15 and start==0:
-                self.cache['video'] = ResultList(response['video'], 0, response['total'])
+            response = self.get_cached_attribute(cache, 'video', results=results, start=start)
             return ResultList(response['video'], start, response['total'])
     
     video = property(get_video)
 
+    def iter_video(self, page_size=15, start=0, prefetch=1, cache=True):
+        """Iterate over all of an artist's video document dicts, fetching page_size at a time
+        
+        Kwargs:
+            page_size (int): The number of results to fetch per API call
+            
+            start (int): An integer starting value for the result set
+            
+            prefetch (int): The number of pages to fetch ahead of the one being read, concurrently
+        
+        Returns:
+            A generator of video document dicts
+        """
+        return util.paginate(lambda s, r: self.get_video(results=r, start=s, cache=cache),
+                             page_size, start, prefetch)
+
     def get_years_active(self, cache=True):
         """Get a list of years active dictionaries for an artist
         
@@ -728,11 +864,42 @@ class Artist(ArtistProxy):
     
     doc_counts = property(get_doc_counts)
 
+class ArtistRecord(collections.namedtuple('ArtistRecord', 'id name extra')):
+    """
+    A compact, read-only artist for bulk results: a tuple with no per-instance dict or cache.
+    extra holds the other response fields (familiarity, hotttnesss, ...) as a dict, or None.
+    
+    Use to_artist() to get a full Artist object when you need one.
+    """
+    __slots__ = ()
+    
+    @classmethod
+    def from_response(cls, artist_dict, fields=None):
+        """Build a record from a decoded API artist dict; fields limits which extra fields are kept"""
+        if fields is None:
+            extra = dict(artist_dict)
+            extra.pop('id', None)
+            extra.pop('name', None)
+        else:
+            extra = dict((f, artist_dict[f]) for f in fields if f in artist_dict)
+        return cls(artist_dict['id'], artist_dict.get('name'), extra or None)
+    
+    def get(self, field, default=None):
+        """Look up one of the extra response fields"""
+        return self.extra.get(field, default) if self.extra else default
+    
+    def to_artist(self):
+        """A full Artist object with the same data"""
+        artist_dict = dict(self.extra or ())
+        artist_dict.update(id=self.id, name=self.name)
+        return Artist.from_response(artist_dict)
+
 def search(name=None, description=None, style=None, mood=None, start=0, \
             results=15, buckets=None, limit=False, \
             fuzzy_match=False, sort=None, max_familiarity=None, min_familiarity=None, \
             max_hotttnesss=None, min_hotttnesss=None, test_new_things=None, rank_type=None, \
-            artist_start_year_after=None, artist_start_year_before=None,artist_end_year_after=None,artist_end_year_before=None):
+            artist_start_year_after=None, artist_start_year_before=None,artist_end_year_after=None,artist_end_year_before=None, \
+            records=False):
     """Search for artists by name, description, or constraint.
     
     Args:
@@ -774,6 +941,9 @@ def search(name=None, description=None, style=None, mood=None, start=0, \
         
         rank_type (str): A string denoting the desired ranking for description searches, either 'relevance' or 'familiarity'
 
+        records (bool or list): Return compact ArtistRecords instead of Artist objects; a list of field
+        names (e.g. ['hotttnesss']) keeps only those extra fields in each record
+
     Returns:
         A list of Artist objects
     
@@ -790,9 +960,15 @@ def search(name=None, description=None, style=None, mood=None, start=0, \
     kwargs = locals()
     kwargs['bucket'] = buckets or []
     del kwargs['buckets']
+    del kwargs['records']
     """Search for artists"""
     result = util.callm("%s/%s" % ('artist', 'search'), kwargs)
-    return [Artist(**util.fix(a_dict)) for a_dict in result['response']['artists']]
+    if records is False:
+        build = Artist.from_response
+    else:
+        fields = None if records is True else records
+        build = lambda a_dict: ArtistRecord.from_response(a_dict, fields)
+    return [build(a_dict) for a_dict in result['response']['artists']]
 
 def top_hottt(start=0, results=15, buckets = None, limit=False):
     """Get the top hotttest artists, according to The Echo Nest
@@ -832,7 +1008,7 @@ def top_hottt(start=0, results=15, buckets = None, limit=False):
     
     """Get top hottt artists"""
     result = util.callm("%s/%s" % ('artist', 'top_hottt'), kwargs)
-    return [Artist(**util.fix(a_dict)) for a_dict in result['response']['artists']]    
+    return [Artist.from_response(a_dict) for a_dict in result['response']['artists']]    
 
 
 def top_terms(results=15):
@@ -993,7 +1169,7 @@ def similar(names=None, ids=None, start=0, results=15, buckets=None, limit=False
 
 
     result = util.callm("%s/%s" % ('artist', 'similar'), kwargs)
-    return [Artist(**util.fix(a_dict)) for a_dict in result['response']['artists']]
+    return [Artist.from_response(a_dict) for a_dict in result['response']['artists']]
 
 def extract(text='', start=0, results=15, buckets=None, limit=False, max_familiarity=None, min_familiarity=None,
                 max_hotttnesss=None, min_hotttnesss=None):
@@ -1056,7 +1232,7 @@ def extract(text='', start=0, results=15, buckets=None, limit=False, max_familia
     
     result = util.callm("%s/%s" % ('artist', 'extract'), kwargs)
     
-    return [Artist(**util.fix(a_dict)) for a_dict in result['response']['artists']]
+    return [Artist.from_response(a_dict) for a_dict in result['response']['artists']]
 
 
 def suggest(q='', results=15, buckets=None, limit=False, max_familiarity=None, min_familiarity=None,
@@ -1116,4 +1292,130 @@ def suggest(q='', results=15, buckets=None, limit=False, max_familiarity=None, m
 
     result = util.callm("%s/%s" % ('artist', 'suggest'), kwargs)
 
-    return [Artist(**util.fix(a_dict)) for a_dict in result['response']['artists']]
+    return [Artist.from_response(a_dict) for a_dict in result['response']['artists']]
+
+
+class Suggester(object):
+    """
+    Answers artist.suggest autocomplete queries from memory where it can.
+    
+    It keeps the artist/suggest response for each prefix it has asked about, plus a sorted index of known
+    artist names and familiarity scores that is filled from those responses (and from add_artists).
+    A prefix is answered locally when it was asked before, when a shorter prefix already returned every
+    matching artist, or when the index holds at least local_results matching names; otherwise
+    artist/suggest is called.
+    
+    Kwargs:
+        results (int): An integer number of results to return
+        
+        local_results (int): How many index matches are enough to answer without the API; None
+        only answers from the index when a shorter prefix was complete
+        
+        cache_size (int): The number of prefix responses to keep
+        
+        cache_ttl (float): How long (seconds) to keep a prefix response
+        
+        max_familiarity (float): A float specifying the max familiarity of artists to suggest
+        
+        min_familiarity (float): A float specifying the min familiarity of artists to suggest
+    
+    Example:
+    
+    >>> s = artist.Suggester(results=10)
+    >>> s.suggest('rad')
+    [<artist - Radiohead>, <artist - Rage Against the Machine>, ...]
+    >>> s.suggest('radi')  # answered from the 'rad' response
+    [<artist - Radiohead>, ...]
+    """
+    def __init__(self, results=15, local_results=None, cache_size=10000, cache_ttl=3600,
+                 max_familiarity=None, min_familiarity=None):
+        self.results = results
+        self.local_results = local_results
+        self.max_familiarity = max_familiarity
+        self.min_familiarity = min_familiarity
+        self._prefixes = util.TTLCache(cache_size, cache_ttl)
+        self._keys = []
+        self._entries = []
+        self._known = set()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _normalize(q):
+        return u' '.join(q.lower().split()) if isinstance(q, unicode) else ' '.join(q.decode('utf-8').lower().split())
+    
+    def add_artists(self, artists):
+        """Add Artist objects or artist dicts (with 'id', 'name' and optionally 'familiarity') to the index"""
+        with self._lock:
+            for a in artists:
+                if isinstance(a, Artist):
+                    a = {'id': a.id, 'name': a.name, 'familiarity': a.cache.get('familiarity')}
+                if a['id'] in self._known:
+                    continue
+                key = self._normalize(a['name'])
+                i = bisect.bisect_right(self._keys, key)
+                self._keys.insert(i, key)
+                entry = {'id': a['id'], 'name': a['name']}
+                # an unknown familiarity is left out, so suggested Artists don't cache a made-up value
+                if a.get('familiarity') is not None:
+                    entry['familiarity'] = a['familiarity']
+                self._entries.insert(i, entry)
+                self._known.add(a['id'])
+    
+    @staticmethod
+    def _familiarity(entry):
+        # unknown familiarity ranks and filters as 0
+        return entry.get('familiarity') or 0.0
+    
+    def _wanted(self, entry):
+        familiarity = self._familiarity(entry)
+        return ((self.max_familiarity is None or familiarity <= self.max_familiarity) and
+                (self.min_familiarity is None or familiarity >= self.min_familiarity))
+    
+    def _from_index(self, prefix):
+        with self._lock:
+            lo = bisect.bisect_left(self._keys, prefix)
+            hi = bisect.bisect_left(self._keys, prefix + u'\uffff')
+            matches = [e for e in self._entries[lo:hi] if self._wanted(e)]
+        matches.sort(key=lambda e: -self._familiarity(e))
+        return matches
+    
+    def _complete_parent(self, prefix):
+        # a shorter prefix whose response had fewer than results artists already named every match
+        for n in xrange(len(prefix) - 1, 0, -1):
+            parent = self._prefixes.get(prefix[:n])
+            if parent is not None:
+                return len(parent) < self.results
+        return False
+    
+    def suggest(self, q):
+        """Suggest artists whose names start with q
+        
+        Args:
+            q (str): The text to suggest artists from
+        
+        Returns:
+            A list of Artist objects
+        """
+        prefix = self._normalize(q)
+        found = self._prefixes.get(prefix)
+        result = None
+        if found is None:
+            local = self._from_index(prefix)
+            if self._complete_parent(prefix):
+                found = local[:self.results]
+            elif self.local_results is not None and len(local) >= self.local_results:
+                # good enough, but not known to be complete, so not remembered as a prefix response
+                util.metrics.count_cache('artist/suggest', True)
+                return [Artist.from_response(a_dict) for a_dict in local[:self.results]]
+            else:
+                kwargs = {'q': q, 'results': self.results, 'bucket': ['familiarity']}
+                if self.max_familiarity is not None:
+                    kwargs['max_familiarity'] = self.max_familiarity
+                if self.min_familiarity is not None:
+                    kwargs['min_familiarity'] = self.min_familiarity
+                result = util.callm("%s/%s" % ('artist', 'suggest'), kwargs)
+                found = result['response']['artists']
+                self.add_artists(found)
+            self._prefixes[prefix] = found
+        util.metrics.count_cache('artist/suggest', result is None)
+        return [Artist.from_response(a_dict) for a_dict in found]
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Copyright (c) 2010 The Echo Nest. All rights reserved.
+
+The Cassette module records API calls and analysis downloads to a file and plays them back later,
+so a pipeline can be rerun (and profiled) offline against the traffic it really saw.
+
+>>> from pyechonest import cassette, artist
+>>> with cassette.Cassette('weezer.cassette', mode='record'):
+...     artist.Artist('weezer').get_similar(results=5)
+>>> with cassette.Cassette('weezer.cassette', mode='replay'):
+...     artist.Artist('weezer').get_similar(results=5)   # no network
+"""
+try:
+    import json
+except ImportError:
+    import simplejson as json
+import base64
+import gzip
+import hashlib
+import httplib
+import StringIO
+import threading
+import time
+import urllib
+import urlparse
+
+import config
+import util
+
+_VERSION = 1
+
+# params that change on every call, or that are secrets, and so are left out of recordings and matching
+SECRET_PARAMS = ('api_key', 'oauth_consumer_key', 'oauth_nonce', 'oauth_timestamp', 'oauth_signature',
+                 'oauth_signature_method', 'oauth_version')
+
+class CassetteError(util.EchoNestException):
+    """A replayed request that is not on the cassette"""
+    def __init__(self, message):
+        super(CassetteError, self).__init__(-1, message, None)
+
+class CassetteResponse(object):
+    """A recorded response, with the read/getcode/headers interface of a urllib2 response"""
+    def __init__(self, url, code, header_lines, body):
+        self.url = url
+        self.code = code
+        self.headers = httplib.HTTPMessage(StringIO.StringIO(''.join(header_lines) + '\r\n'))
+        self._body = StringIO.StringIO(body)
+
+    def read(self, size=-1):
+        return self._body.read(size)
+
+    def getcode(self):
+        return self.code
+
+    def geturl(self):
+        return self.url
+
+    def info(self):
+        return self.headers
+
+    def close(self):
+        pass
+
+def request_key(url, data=None, headers=None):
+    """
+    What a request is matched on: the method path and its sorted params without secrets for API
+    calls (form bodies included), or just the host and path for anything else, e.g. analysis URLs
+    whose signed query strings change every time.
+    """
+    parts = urlparse.urlsplit(url)
+    prefix = '/%s/%s/' % (config.API_SELECTOR, config.API_VERSION)
+    if not parts.path.startswith(prefix):
+        return ('GET' if data is None else 'POST', parts.netloc + parts.path, ())
+    params = urlparse.parse_qsl(parts.query, keep_blank_values=True)
+    content_type = dict((k.lower(), v) for (k, v) in (headers or {}).iteritems()).get('content-type', '')
+    if data is not None and content_type.startswith('application/octet-stream'):
+        params.append(('body_md5', hashlib.md5(data).hexdigest()))
+    elif data:
+        params.extend(urlparse.parse_qsl(data, keep_blank_values=True))
+    params = tuple(sorted((k, v) for (k, v) in params if k not in SECRET_PARAMS))
+    return ('GET' if data is None else 'POST', parts.path[len(prefix):], params)
+
+def _strip_secrets(url):
+    parts = urlparse.urlsplit(url)
+    query = [(k, v) for (k, v) in urlparse.parse_qsl(parts.query, keep_blank_values=True) if k not in SECRET_PARAMS]
+    return urlparse.urlunsplit(parts._replace(query=urllib.urlencode(query)))
+
+class Cassette(object):
+    """
+    A transport (see util.set_transport) that records requests and responses to a gzipped file of
+    JSON lines, or plays them back from one.
+
+    Args:
+        filename (str): The cassette file
+
+    Kwargs:
+        mode (str): 'record' passes every request on to the real transport and keeps the response;
+        'replay' answers from the file and never touches the network
+
+        speed (float): In replay mode, how fast to answer relative to the recording: 1.0 keeps the
+        recorded timeline (no call starts sooner after the first one than it did when recorded, and each
+        takes as long as it did), 10.0 runs it ten times faster, and None (the default) does not wait at all
+
+        transport: The transport recorded calls go through; plain HTTP by default
+
+    Requests are matched on request_key: the method, normalized params without the API key
+    or oauth signature, and a hash of any uploaded file. A request made several times plays its
+    recorded responses in order, then keeps repeating the last one (so polling for a pending track
+    replays the way it was recorded).
+
+    Use it as a context manager to install it as util.transport (and save a recording on the way
+    out), or call util.set_transport and save yourself.
+    """
+
+    def __init__(self, filename, mode='replay', speed=None, transport=None):
+        if mode not in ('record', 'replay'):
+            raise ValueError("Cassette mode must be 'record' or 'replay', got %r" % (mode,))
+        self.filename = filename
+        self.mode = mode
+        self.speed = speed
+        self.transport = transport or util.HTTPTransport()
+        self.interactions = []
+        self._served = {}
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._replay_start = None
+        self._previous = None
+        if mode == 'replay':
+            self.load()
+
+    def load(self):
+        f = gzip.open(self.filename, 'rb')
+        try:
+            header = json.loads(f.readline())
+            if header.get('cassette') != _VERSION:
+                raise ValueError("%s is not a version %d cassette" % (self.filename, _VERSION))
+            self.interactions = [json.loads(line) for line in f if line.strip()]
+        finally:
+            f.close()
+        self._index = {}
+        for interaction in self.interactions:
+            params = tuple((k.encode('utf-8'), v.encode('utf-8')) for (k, v) in interaction['params'])
+            key = (interaction['method'], interaction['key'].encode('utf-8'), params)
+            self._index.setdefault(key, []).append(interaction)
+
+    def save(self):
+        """Write the recorded interactions to the cassette file"""
+        f = gzip.open(self.filename, 'wb')
+        try:
+            f.write(json.dumps({'cassette': _VERSION, 'recorded': int(self._started)}) + '\n')
+            with self._lock:
+                for interaction in self.interactions:
+                    f.write(json.dumps(interaction, separators=(',', ':')) + '\n')
+        finally:
+            f.close()
+
+    def open(self, url, data=None, headers=None):
+        key = request_key(url, data, headers)
+        if self.mode == 'record':
+            return self._record(key, url, data, headers)
+        return self._replay(key, url)
+
+    def _record(self, key, url, data, headers):
+        start = time.time()
+        f = self.transport.open(url, data, headers)
+        body = f.read()
+        elapsed = time.time() - start
+        interaction = {
+            'method': key[0], 'key': key[1], 'params': key[2], 'url': _strip_secrets(url),
+            'offset': start - self._started, 'elapsed': elapsed,
+            'status': f.getcode(), 'headers': list(getattr(f.headers, 'headers', None) or []),
+        }
+        try:
+            interaction['body'] = body.decode('utf-8')
+        except UnicodeDecodeError:
+            interaction['body_base64'] = base64.b64encode(body)
+        with self._lock:
+            self.interactions.append(interaction)
+        return CassetteResponse(url, f.getcode(), interaction['headers'], body)
+
+    def _replay(self, key, url):
+        with self._lock:
+            recorded = self._index.get(key)
+            if not recorded:
+                raise CassetteError("No recorded response for %s %s %s" % (key[0], key[1], urllib.urlencode(key[2])))
+            n = self._served.get(key, 0)
+            self._served[key] = n + 1
+            interaction = recorded[min(n, len(recorded) - 1)]
+            if self.speed and self._replay_start is None:
+                # the first replayed call lines the recorded timeline up with the clock
+                self._replay_start = time.time() - interaction['offset'] / self.speed
+        if self.speed:
+            # wait out the recorded gap before the call, if the caller has not already, then the call itself
+            gap = self._replay_start + interaction['offset'] / self.speed - time.time()
+            time.sleep(max(gap, 0) + interaction['elapsed'] / self.speed)
+        if 'body_base64' in interaction:
+            body = base64.b64decode(interaction['body_base64'])
+        else:
+            body = interaction['body'].encode('utf-8')
+        return CassetteResponse(url, interaction['status'], interaction['headers'], body)
+
+    def __enter__(self):
+        self._previous = util.set_transport(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        util.set_transport(self._previous)
+        if self.mode == 'record':
+            self.save()
@@ -221,14 +221,14 @@ class Catalog(CatalogProxy):
                 item['id'] = item.pop('song_id')
                 item['title'] = item.pop('song_name')
                 request = item['request']
-                new_item = song.Song(**util.fix(item))
+                new_item = song.Song.from_response(item)
                 new_item.request = request
             # artist item
             elif 'artist_id' in item:
                 item['id'] = item.pop('artist_id')
                 item['name'] = item.pop('artist_name')
                 request = item['request']
-                new_item = artist.Artist(**util.fix(item))
+                new_item = artist.Artist.from_response(item)
                 new_item.request = request
             # unresolved item
             else:
@@ -386,7 +386,7 @@ def get_catalog_by_name(name):
             'name' : name,
         }
     result = util.callm("%s/%s" % ('catalog', 'profile'), kwargs)
-    return Catalog(**util.fix(result['response']['catalog']))
+    return Catalog.from_response(result['response']['catalog'])
 
 def list_catalogs(results=30, start=0):
     """
@@ -410,7 +410,7 @@ def list_catalogs(results=30, start=0):
 
     """
     result = util.callm("%s/%s" % ('catalog', 'list'), {'results': results, 'start': start})
-    cats = [Catalog(**util.fix(d)) for d in result['response']['catalogs']]
+    cats = [Catalog.from_response(d) for d in result['response']['catalogs']]
     start = result['response']['start']
     total = result['response']['total']
     return ResultList(cats, start, total)
@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Copyright (c) 2010 The Echo Nest. All rights reserved.
+
+The Client module holds what an API call needs (keys, host, timeout, transport, quota ledger and
+response cache) in an object, so one process can talk to several hosts, or spread its calls over
+several API keys.
+
+util.callm and util.oauthgetm, and so every module function and object in pyechonest, use the
+current client: the innermost one entered with a with statement in this thread, or the default
+client, which reads config on every call just as before.
+
+>>> from pyechonest import client, artist
+>>> pool = client.Client(api_key=['KEY1', 'KEY2', 'KEY3'], key_policy='least_used', cache_ttl=300)
+>>> with pool:
+...     artist.Artist('weezer').get_similar()
+"""
+import collections
+import hashlib
+import logging
+import threading
+import time
+import urllib
+
+import config
+import util
+
+logger = logging.getLogger(__name__)
+
+KEY_POLICIES = ('round_robin', 'least_used')
+"Built-in ways for a Client to pick the key for each call (key_policy may also be a callable)"
+
+def _transient(error):
+    """Whether error may go away on its own: a network or server error, or a rate limit"""
+    if isinstance(error, util.EchoNestAPIError):
+        return error.code in (-1, 3) or (error.http_status or 0) >= 500
+    return isinstance(error, util.EchoNestIOError)
+
+class _CachedResponse(object):
+    """A decoded response in a Client's cache, with what is needed to revalidate it"""
+    __slots__ = ('response', 'digest', 'etag', 'last_modified')
+
+    def __init__(self, response, digest, etag=None, last_modified=None):
+        self.response = response
+        self.digest = digest
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers or None
+
+class Client(object):
+    """
+    An API client.
+
+    Kwargs:
+        api_key (str or list): The key, or a list of keys to spread calls over; config.ECHO_NEST_API_KEY if None
+
+        api_host (str): The host to call; config.API_HOST if None
+
+        api_selector (str): config.API_SELECTOR if None
+
+        api_version (str): config.API_VERSION if None
+
+        call_timeout (float): The socket timeout (seconds); config.CALL_TIMEOUT if None
+
+        consumer_key (str): The oauth consumer key; config.ECHO_NEST_CONSUMER_KEY if None
+
+        shared_secret (str): The oauth shared secret; config.ECHO_NEST_SHARED_SECRET if None
+
+        transport: What requests are sent through (see util.set_transport); util.transport if None
+
+        quota (util.QuotaLedger): Where calls are accounted and budgeted; a ledger of its own if None
+
+        cache_ttl (float): Seconds to keep GET responses and answer repeated calls from memory;
+        None (the default) turns the response cache off. An expired response is revalidated with
+        If-None-Match/If-Modified-Since when the server sent an ETag or Last-Modified, and a 304 (or a
+        body identical to the cached one) keeps the decoded response without decoding it again.
+
+        cache_size (int): The most responses to keep
+
+        stale_while_revalidate (float): For this many seconds after a cached response expires, return it
+        at once and refresh it in a background thread (one refresh per response at a time)
+
+        stale_if_error (float): For this many seconds after a cached response expires, return it when
+        a refresh fails with a network, server or rate limit error
+
+        negative_ttl (float): Seconds to remember that a GET failed with a "not found" error (code 5),
+        raising the same error again without calling the API, e.g. for a misspelled artist name or an
+        unknown track md5; config.NEGATIVE_CACHE_TTL if None, and 0 turns it off. Network, server
+        and rate limit errors are never remembered, and a successful POST (catalog/create,
+        track/upload, ...) forgets everything remembered for that type of object.
+
+        key_policy (str): How to pick a key from several: 'round_robin', 'least_used' (the key with the
+        least cost in the quota window), or a callable taking the client and method and returning a key.
+        A key that gets a rate limit error (code 3) is rested for a quota window and the call is
+        retried with the next key.
+    """
+
+    UNCACHED_METHODS = ('playlist/dynamic/', 'catalog/', 'track/', 'sandbox/')
+    """Methods (prefixes) whose responses change between identical calls, and so are never cached"""
+
+    NOT_FOUND_CODES = (5,)
+    """API error codes for a request naming something that does not exist (the negative cache keeps these)"""
+
+    def __init__(self, api_key=None, api_host=None, api_selector=None, api_version=None, call_timeout=None,
+                 consumer_key=None, shared_secret=None, transport=None, quota=None, cache_ttl=None,
+                 cache_size=1000, key_policy='round_robin', stale_while_revalidate=None, stale_if_error=None,
+                 negative_ttl=None):
+        if isinstance(api_key, basestring):
+            api_key = [api_key]
+        if not callable(key_policy) and key_policy not in KEY_POLICIES:
+            raise ValueError("key_policy must be one of %s or a callable" % ', '.join(KEY_POLICIES))
+        self._api_keys = list(api_key or [])
+        self._api_host = api_host
+        self._api_selector = api_selector
+        self._api_version = api_version
+        self._call_timeout = call_timeout
+        self._consumer_key = consumer_key
+        self._shared_secret = shared_secret
+        self._transport = transport
+        self.quota = quota if quota is not None else util.QuotaLedger()
+        self.cache = util.TTLCache(cache_size, cache_ttl) if cache_ttl is not None else None
+        self.stale_while_revalidate = stale_while_revalidate
+        self.stale_if_error = stale_if_error
+        self._negative_ttl = negative_ttl
+        self._negative = util.TTLCache(cache_size)
+        self._generations = collections.Counter()
+        self.key_policy = key_policy
+        self._lock = threading.Lock()
+        self._next = 0
+        self._resting = {}
+        self._refreshing = set()
+
+    api_keys = property(lambda self: self._api_keys or [config.ECHO_NEST_API_KEY])
+    api_host = property(lambda self: self._api_host or config.API_HOST)
+    api_selector = property(lambda self: self._api_selector or config.API_SELECTOR)
+    api_version = property(lambda self: self._api_version or config.API_VERSION)
+    call_timeout = property(lambda self: self._call_timeout or config.CALL_TIMEOUT)
+    consumer_key = property(lambda self: self._consumer_key or config.ECHO_NEST_CONSUMER_KEY)
+    shared_secret = property(lambda self: self._shared_secret or config.ECHO_NEST_SHARED_SECRET)
+    transport = property(lambda self: self._transport or util.transport)
+    negative_ttl = property(lambda self: self._negative_ttl if self._negative_ttl is not None
+                            else config.NEGATIVE_CACHE_TTL)
+
+    def __repr__(self):
+        return "<Client - %s, %d key(s)>" % (self.api_host, len(self.api_keys))
+
+    def __enter__(self):
+        _stack().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _stack().pop()
+
+    def next_key(self, method):
+        """The API key to use for the next call to method"""
+        keys = self.api_keys
+        if len(keys) == 1:
+            return keys[0]
+        if callable(self.key_policy):
+            return self.key_policy(self, method)
+        now = time.time()
+        with self._lock:
+            ready = [k for k in keys if self._resting.get(k, 0) <= now] or keys
+            if self.key_policy == 'least_used':
+                return min(ready, key=self.quota.window_cost)
+            self._next += 1
+            return ready[self._next % len(ready)]
+
+    def _rest(self, key):
+        with self._lock:
+            self._resting[key] = time.time() + self.quota.window
+
+    def _url(self, method, params=None):
+        url = 'http://%s/%s/%s/%s' % (self.api_host, self.api_selector, self.api_version, method)
+        return url + '?' + params if params is not None else url
+
+    def _with_keys(self, method, param_dict, call):
+        # try each key in turn while the API says the one we used is over its rate limit
+        keys = self.api_keys
+        for attempt in xrange(len(keys)):
+            param_dict['api_key'] = key = self.next_key(method)
+            try:
+                return call()
+            except util.EchoNestAPIError, e:
+                if e.code != 3 or attempt == len(keys) - 1:
+                    raise
+                self._rest(key)
+                util.metrics.count_retry(method)
+
+    def _request_key(self, method, param_dict):
+        return (self.api_host, method, tuple(p for p in util.normalize_params(param_dict) if p[0] != 'api_key'))
+
+    def _cache_key(self, method, param_dict):
+        if self.cache is None or method.startswith(self.UNCACHED_METHODS):
+            return None
+        return self._request_key(method, param_dict)
+
+    def callm(self, method, param_dict, POST=False, socket_timeout=None, data=None):
+        """
+        Call the api!
+        Param_dict is a *regular* *python* *dictionary* so if you want to have multi-valued params
+        put them in a list.
+        """
+        object_type = method.split('/')[0]
+        negative_key = None
+        if not POST and self.negative_ttl:
+            # a recent "not found" for this very request, with no write to this type of object since
+            negative_key = self._request_key(method, param_dict)
+            generation = self._generations[object_type]
+            miss = self._negative.get(negative_key)
+            if miss is not None and miss[0] == generation:
+                util.metrics.count_cache(method, True)
+                raise miss[1]
+        cache_key = None if POST else self._cache_key(method, param_dict)
+        cached = expired_for = None
+        if cache_key is not None:
+            cached, expired_for = self.cache.get_stale(cache_key)
+            grace = cached is not None and self.stale_while_revalidate and expired_for <= self.stale_while_revalidate
+            util.metrics.count_cache(method, cached is not None and (expired_for <= 0 or grace))
+            if cached is not None and expired_for <= 0:
+                return cached.response
+            if grace:
+                self._refresh_later(method, param_dict, cache_key, cached)
+                return cached.response
+        try:
+            response_dict = self._fetch(method, param_dict, POST, socket_timeout, data, cache_key, cached)
+        except util.EchoNestException, e:
+            if negative_key is not None and isinstance(e, util.EchoNestAPIError) and e.code in self.NOT_FOUND_CODES:
+                self._negative.set(negative_key, (generation, e), self.negative_ttl)
+            if cached is None or not self.stale_if_error or expired_for > self.stale_if_error or not _transient(e):
+                raise
+            logger.warning("%s failed (%s); serving a response %.0fs stale" % (method, e, expired_for))
+            return cached.response
+        if POST:
+            # whatever was not found may exist now
+            with self._lock:
+                self._generations[object_type] += 1
+        return response_dict
+
+    def _refresh_later(self, method, param_dict, cache_key, cached):
+        # one background refresh per entry at a time; the caller tag goes along for quota accounting
+        with self._lock:
+            if cache_key in self._refreshing:
+                return
+            self._refreshing.add(cache_key)
+        def refresh():
+            try:
+                self._fetch(method, dict(param_dict), False, None, None, cache_key, cached)
+            except Exception, e:
+                logger.warning("Background refresh of %s failed: %s" % (method, e))
+            finally:
+                with self._lock:
+                    self._refreshing.discard(cache_key)
+        util.start_thread(refresh, 'pyechonest-refresh')
+
+    def _fetch(self, method, param_dict, POST, socket_timeout, data, cache_key, cached):
+        try:
+            with util.request_timeout(socket_timeout or self.call_timeout):
+                return self._with_keys(method, param_dict,
+                                       lambda: self._callm(method, param_dict, POST, data, cache_key, cached))
+
+        except IOError, e:
+            if hasattr(e, 'reason'):
+                raise util.EchoNestIOError(error=e.reason)
+            elif hasattr(e, 'code'):
+                raise util.EchoNestIOError(code=e.code)
+            else:
+                raise
+
+    def _callm(self, method, param_dict, POST, data, cache_key, cached=None):
+        params = urllib.urlencode(util.encode_params(param_dict))
+        send = lambda url, body=None, headers=None: util._send(method, url, body, headers, param_dict,
+                                                               self.quota, self.transport.open, decode)
+        def decode(raw_json, f):
+            if cache_key is None:
+                return util._decode_api_response(raw_json, f)
+            digest = hashlib.md5(raw_json).digest()
+            if cached is not None and (f.getcode() == 304 or digest == cached.digest):
+                # not modified: keep what was decoded last time
+                response_dict, digest = cached.response, cached.digest
+            else:
+                response_dict = util._decode_api_response(raw_json, f)
+            self.cache.set(cache_key, _CachedResponse(response_dict, digest, util.response_header(f, 'etag'),
+                                                      util.response_header(f, 'last-modified')))
+            return response_dict
+
+        if(POST):
+            if (not method == 'track/upload') or ((method == 'track/upload') and 'url' in param_dict):
+                """
+                this is a normal POST call
+                """
+                body = "&".join([urllib.urlencode(data or ''), params])
+                return send(self._url(method), body)
+            else:
+                """
+                upload with a local file is special, as the body of the request is the content of the file,
+                and the other parameters stay on the URL
+                """
+                return send(self._url(method, params), data, {'Content-Type': 'application/octet-stream'})
+        else:
+            """
+            just a normal GET call
+            """
+            return send(self._url(method, params), None, cached.conditional_headers() if cached else None)
+
+    def oauthgetm(self, method, param_dict, socket_timeout=None):
+        try:
+            import oauth2 # lazy import this so oauth2 is not a hard dep
+        except ImportError:
+            raise Exception("You must install the python-oauth2 library to use this method.")
+
+        def build_request(url):
+            params = {
+                'oauth_version': "1.0",
+                'oauth_nonce': oauth2.generate_nonce(),
+                'oauth_timestamp': int(time.time())
+                }
+            consumer = oauth2.Consumer(key=self.consumer_key, secret=self.shared_secret)
+            params['oauth_consumer_key'] = self.consumer_key
+
+            req = oauth2.Request(method='GET', url=url, parameters=params)
+            signature_method = oauth2.SignatureMethod_HMAC_SHA1()
+            req.sign_request(signature_method, consumer, None)
+            return req
+
+        def call():
+            url = self._url(method, urllib.urlencode(util.encode_params(param_dict)))
+            return util._send(method, build_request(url).to_url(), params=param_dict, ledger=self.quota,
+                              open_url=self.transport.open)
+
+        with util.request_timeout(socket_timeout or self.call_timeout):
+            return self._with_keys(method, param_dict, call)
+
+
+default_client = Client(quota=util.quota)
+"""The client used outside any with block; it reads config and util.transport on every call"""
+
+_local = threading.local()
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+def get_client():
+    """The client module functions use in this thread right now"""
+    stack = _stack()
+    return stack[-1] if stack else default_client
+
+def set_default_client(new_client):
+    """Make new_client the client used outside any with block (None restores one that reads config)"""
+    global default_client
+    default_client = new_client or Client(quota=util.quota)
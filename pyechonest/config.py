@@ -8,12 +8,8 @@ Created by Tyler Williams on 2010-04-25.
 Global configuration variables for accessing the Echo Nest web API.
 """
 
-import pkg_resources
-
-try:
-    __version__ = pkg_resources.require("pyechonest")[0].version
-except pkg_resources.DistributionNotFound:
-    __version__ = "0.0.0"
+__version__ = "9.0.0"
+"The pyechonest version; setup.py reads it from here, so importing pyechonest never scans installed distributions"
 
 import sys, os
 
@@ -46,3 +42,56 @@ CALL_TIMEOUT = 10
 """
 The API call timeout (seconds)
 """
+
+RESULT_CACHE_SIZE = 64
+"""
+The number of distinct argument combinations (pages, filters) each object remembers results for
+"""
+
+RESULT_CACHE_TTL = 600
+"""
+How long (seconds) an object remembers a result for; None to keep results until evicted
+"""
+
+JSON_BACKEND = None
+"""
+The JSON library used to decode API responses ('ujson', 'simplejson' or 'json');
+None picks the fastest one installed. See util.set_json_backend
+"""
+
+JSON_STR_KEYS = False
+"""
+If true, decode JSON object keys as str instead of unicode so objects can be built without rebuilding dicts
+(not supported by ujson, which is then not used)
+"""
+
+ACCEPT_ENCODING = 'gzip, deflate'
+"""
+The compressed encodings API responses and analysis documents may be sent in; None asks for them uncompressed
+"""
+
+NEGATIVE_CACHE_TTL = None
+"""
+How long (seconds) to remember that an API lookup found nothing (see client.Client); None to always ask again
+"""
+
+IDENTITY_MAP = False
+"""
+If true, all live Artist (and Song) objects with the same Echo Nest ID share one cache, so what one
+fetches the others see; objects built later for a live ID also need no profile call
+"""
+
+COLLECT_METRICS = True
+"""
+If true, API calls are counted and timed per endpoint in util.metrics
+"""
+
+QUOTA_COSTS = {}
+"""
+The estimated quota cost of each API method, e.g. {'track/upload': 5}; methods not listed cost 1
+"""
+
+QUOTA_BATCH_SHARE = 0.5
+"""
+The share of each budget batch callers (see util.caller) may use while interactive calls are being made
+"""
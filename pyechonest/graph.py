@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Copyright (c) 2010 The Echo Nest. All rights reserved.
+
+The Graph module crawls artist/similar breadth-first into a compact local adjacency store,
+so neighbourhood and path queries can be answered without calling the API.
+"""
+import array
+import collections
+import struct
+import sys
+import Queue
+
+import util
+from proxies import ArtistProxy
+
+_MAGIC = 'ENAG'
+_VERSION = 1
+_HEADER = struct.Struct('<4sBIII')
+
+class ArtistGraph(object):
+    """
+    A directed similar-artist graph stored CSR-style: the edges of node i are
+    targets[offsets[i]:offsets[i+1]] with the matching weights, and ids/names map node numbers
+    back to Echo Nest artist IDs.
+
+    Build one with crawl, or load a saved one:
+
+    >>> g = graph.crawl(['ARH6W4X1187B99274F'], depth=2, max_nodes=500)
+    >>> g.save('indie.graph')
+    >>> g = graph.ArtistGraph.load('indie.graph')
+    >>> g.shortest_path('ARH6W4X1187B99274F', 'AR6XZ861187FB4CECD')
+    ['ARH6W4X1187B99274F', 'ARNE7PT1187FB4AEE6', 'AR6XZ861187FB4CECD']
+    """
+
+    def __init__(self, ids=None, names=None, offsets=None, targets=None, weights=None):
+        self.ids = ids or []
+        self.names = names or [None] * len(self.ids)
+        self.index = dict((artist_id, i) for (i, artist_id) in enumerate(self.ids))
+        self.offsets = offsets if offsets is not None else array.array('I', [0] * (len(self.ids) + 1))
+        self.targets = targets if targets is not None else array.array('I')
+        self.weights = weights if weights is not None else array.array('f')
+        self.errors = []
+
+    @classmethod
+    def from_edges(cls, ids, names, edges):
+        """
+        Build a graph from node ids, names and a dict mapping a node number to a list of
+        (target node number, weight) pairs
+        """
+        offsets = array.array('I', [0])
+        targets = array.array('I')
+        weights = array.array('f')
+        for i in xrange(len(ids)):
+            for target, weight in edges.get(i, ()):
+                targets.append(target)
+                weights.append(weight)
+            offsets.append(len(targets))
+        return cls(ids, names, offsets, targets, weights)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, artist_id):
+        return artist_id in self.index
+
+    def __repr__(self):
+        return "<ArtistGraph - %d artists, %d edges>" % (len(self.ids), len(self.targets))
+
+    def _row(self, i):
+        return xrange(self.offsets[i], self.offsets[i + 1])
+
+    def neighbors(self, artist_id):
+        """A list of (artist id, weight) pairs for the artists similar to artist_id, most similar first"""
+        i = self.index[artist_id]
+        return [(self.ids[self.targets[e]], self.weights[e]) for e in self._row(i)]
+
+    def k_hop(self, artist_id, k):
+        """A dict mapping every artist within k similarity hops of artist_id to its hop count"""
+        start = self.index[artist_id]
+        hops = {start: 0}
+        frontier = [start]
+        for depth in xrange(1, k + 1):
+            next_frontier = []
+            for i in frontier:
+                for e in self._row(i):
+                    t = self.targets[e]
+                    if t not in hops:
+                        hops[t] = depth
+                        next_frontier.append(t)
+            frontier = next_frontier
+        return dict((self.ids[i], d) for (i, d) in hops.iteritems())
+
+    def shortest_path(self, source_id, target_id):
+        """The list of artist ids on a fewest-hops path from source_id to target_id, or None"""
+        start, goal = self.index[source_id], self.index[target_id]
+        parents = {start: None}
+        queue = collections.deque([start])
+        while queue:
+            i = queue.popleft()
+            if i == goal:
+                path = []
+                while i is not None:
+                    path.append(self.ids[i])
+                    i = parents[i]
+                return path[::-1]
+            for e in self._row(i):
+                t = self.targets[e]
+                if t not in parents:
+                    parents[t] = i
+                    queue.append(t)
+        return None
+
+    def save(self, filename):
+        """Write the graph to a compact binary file"""
+        labels = '\n'.join('%s\t%s' % (artist_id, name or '') for (artist_id, name) in zip(self.ids, self.names))
+        labels = labels.encode('utf-8') if isinstance(labels, unicode) else labels
+        f = open(filename, 'wb')
+        try:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, len(self.ids), len(self.targets), len(labels)))
+            f.write(labels)
+            for a in (self.offsets, self.targets, self.weights):
+                if sys.byteorder != 'little':
+                    a = array.array(a.typecode, a)
+                    a.byteswap()
+                a.tofile(f)
+        finally:
+            f.close()
+
+    @classmethod
+    def load(cls, filename):
+        """Read a graph written by save"""
+        f = open(filename, 'rb')
+        try:
+            magic, version, n_nodes, n_edges, labels_len = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError("%s is not an artist graph file" % filename)
+            labels = f.read(labels_len).decode('utf-8')
+            arrays = []
+            for typecode, count in (('I', n_nodes + 1), ('I', n_edges), ('f', n_edges)):
+                a = array.array(typecode)
+                a.fromfile(f, count)
+                if sys.byteorder != 'little':
+                    a.byteswap()
+                arrays.append(a)
+        finally:
+            f.close()
+        ids, names = [], []
+        for line in labels.split('\n') if labels else []:
+            artist_id, name = line.split('\t', 1)
+            ids.append(str(artist_id))
+            names.append(name or None)
+        return cls(ids, names, *arrays)
+
+
+def _resolve_seed(seed):
+    if isinstance(seed, ArtistProxy):
+        return seed.id, getattr(seed, 'name', None)
+    parsed = util.parse_id(seed)
+    if parsed is not None:
+        if parsed.kind != 'foreign':
+            return seed, None
+        response = util.callm('artist/profile', {'id': seed})
+    else:
+        response = util.callm('artist/profile', {'name': seed})
+    a = response['response']['artist']
+    return a['id'], a.get('name')
+
+def _similar(artist_id, results, kwargs):
+    params = dict(kwargs)
+    params.update(id=artist_id, results=results)
+    artists = util.callm('artist/similar', params)['response']['artists']
+    # artist/similar gives no score by default, so fall back to a rank-based weight
+    return [(a['id'], a.get('name'), float(a.get('score', 1.0 - float(rank) / max(len(artists), 1))))
+            for (rank, a) in enumerate(artists)]
+
+def _expand_all(artist_ids, results, kwargs, concurrency):
+    jobs = Queue.Queue()
+    for artist_id in artist_ids:
+        jobs.put(artist_id)
+    found = {}
+    errors = []
+    def work():
+        while True:
+            try:
+                artist_id = jobs.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                found[artist_id] = _similar(artist_id, results, kwargs)
+            except Exception, e:
+                # keep going: one bad response must not drop the rest of this worker's queue
+                errors.append((artist_id, e))
+    threads = [util.start_thread(work, 'crawl-%d' % i) for i in xrange(min(concurrency, len(artist_ids)))]
+    for t in threads:
+        t.join()
+    return found, errors
+
+def crawl(seeds, depth=2, max_nodes=1000, results=15, concurrency=8, **kwargs):
+    """Crawl artist/similar breadth-first from some seed artists into an ArtistGraph
+
+    Args:
+        seeds (list): Artist objects, Echo Nest artist IDs, foreign IDs or artist names
+
+    Kwargs:
+        depth (int): How many similarity hops to expand from the seeds
+
+        max_nodes (int): The most artists the graph may hold; artists found after that are not added
+
+        results (int): The number of similar artists to ask for per artist
+
+        concurrency (int): The most artist/similar calls to have in flight at once
+
+        All other kwargs (max_familiarity, min_hotttnesss, ...) are passed to artist/similar.
+
+    Returns:
+        An ArtistGraph. Artists whose similar artists could not be fetched are left without edges and
+        listed with the error in its errors attribute, as (artist id, exception) pairs.
+
+    Raises:
+        The first error, when not a single artist could be expanded
+
+    Example:
+
+    >>> g = graph.crawl(['the national', 'ARH6W4X1187B99274F'], depth=2, max_nodes=200)
+    >>> g
+    <ArtistGraph - 200 artists, 1815 edges>
+    >>> g.k_hop('ARH6W4X1187B99274F', 1)
+    {'ARH6W4X1187B99274F': 0, 'ARNE7PT1187FB4AEE6': 1, ...}
+    """
+    ids, names, index, edges = [], [], {}, {}
+    def add(artist_id, name):
+        if artist_id not in index:
+            if len(ids) >= max_nodes:
+                return None
+            index[artist_id] = len(ids)
+            ids.append(artist_id)
+            names.append(name)
+        return index[artist_id]
+
+    frontier = []
+    for seed in (seeds if isinstance(seeds, list) else [seeds]):
+        artist_id, name = _resolve_seed(seed)
+        if add(artist_id, name) is not None and artist_id not in frontier:
+            frontier.append(artist_id)
+
+    all_errors = []
+    expanded = 0
+    for level in xrange(depth):
+        if not frontier:
+            break
+        found, errors = _expand_all(frontier, results, kwargs, concurrency)
+        for artist_id, e in errors:
+            util.logger.warning("could not expand %s: %s" % (artist_id, e))
+        all_errors.extend(errors)
+        expanded += len(found)
+        next_frontier = []
+        for artist_id in frontier:
+            row = []
+            for target_id, name, weight in found.get(artist_id, ()):
+                new = target_id not in index
+                target = add(target_id, name)
+                if target is None:
+                    continue
+                row.append((target, weight))
+                if new:
+                    next_frontier.append(target_id)
+            edges[index[artist_id]] = row
+        frontier = next_frontier
+    if all_errors and not expanded:
+        raise all_errors[0][1]
+    g = ArtistGraph.from_edges(ids, names, edges)
+    g.errors = all_errors
+    return g
@@ -0,0 +1,798 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Copyright (c) 2010 The Echo Nest. All rights reserved.
+
+The MockServer module runs a local stand-in for the Echo Nest web API, so pyechonest can be
+tested and benchmarked offline. Responses are made up, but they are shaped like the real ones and
+are the same every time for the same request.
+
+>>> from pyechonest import mockserver, artist
+>>> with mockserver.MockServer(latency=0.05) as server:
+...     artist.Artist('weezer').get_similar(results=2)
+[<artist - Artist 6C9D1F0B>, <artist - Artist 0E5A6E1C>]
+
+It can also be run on its own, and config.API_HOST pointed at it:
+
+    python -m pyechonest.mockserver --port 8080 --latency 0.1 --error-rate 0.01
+"""
+try:
+    import json
+except ImportError:
+    import simplejson as json
+import BaseHTTPServer
+import SocketServer
+import collections
+import email.utils
+import gzip
+import hashlib
+import optparse
+import random
+import StringIO
+import threading
+import time
+import urlparse
+import zlib
+
+import config
+
+SUCCESS, MISSING_KEY, RATE_LIMITED, MISSING_PARAMETER, INVALID_PARAMETER = 0, 1, 3, 4, 5
+"API status codes the mock server answers with"
+
+class MockAPIError(Exception):
+    """An API error the mock server reports in the response status"""
+    def __init__(self, code, message, http_status=400):
+        super(MockAPIError, self).__init__(message)
+        self.code = code
+        self.message = message
+        self.http_status = http_status
+
+def _hash(*parts):
+    # query params arrive as utf-8 encoded str, everything else may be unicode or a number
+    parts = [p.encode('utf-8') if isinstance(p, unicode) else str(p) for p in parts]
+    return hashlib.md5('|'.join(parts)).hexdigest().upper()
+
+def _rng(*parts):
+    return random.Random(int(_hash(*parts)[:16], 16))
+
+def _as_int(params, name, default):
+    try:
+        return int(params.get(name, default))
+    except ValueError:
+        raise MockAPIError(INVALID_PARAMETER, "%s must be an integer" % name)
+
+class _MockData(object):
+    """
+    Made-up but stable catalog data. Artist IDs are 'AR' + an 8 character key + a checksum of the key,
+    and an artist's song IDs start with 'SO' + the same key, so a song's artist can be worked out from
+    its ID alone.
+    """
+    def __init__(self, seed, songs_per_artist, documents_per_artist):
+        self.seed = seed
+        self.songs_per_artist = songs_per_artist
+        self.documents_per_artist = documents_per_artist
+        self.names = {}
+
+    def artist_id(self, key):
+        return 'AR' + key + _hash(self.seed, 'artist', key)[:8]
+
+    def artist_key(self, identifier):
+        if identifier.startswith('AR') and len(identifier) == 18:
+            return identifier[2:10]
+        if ':artist:' in identifier:
+            return identifier.rsplit(':', 1)[1][:8].upper().rjust(8, '0')
+        key = _hash(self.seed, 'name', identifier.lower())[:8]
+        self.names.setdefault(key, identifier)
+        return key
+
+    def song_id(self, key, n):
+        return 'SO' + key + _hash(self.seed, 'song', key, n)[:8]
+
+    def artist(self, key, buckets=()):
+        rng = _rng(self.seed, 'artist', key)
+        a = {'id': self.artist_id(key), 'name': self.names.get(key, 'Artist %s' % key)}
+        familiarity = rng.random()
+        hotttnesss = familiarity * rng.uniform(.6, 1.0)
+        start = rng.randint(1960, 2010)
+        fields = {
+            'familiarity': familiarity,
+            'hotttnesss': hotttnesss,
+            'years_active': [{'start': start}] if rng.random() < .7 else [{'start': start, 'end': start + rng.randint(1, 20)}],
+            'artist_location': {'location': 'City %s' % key[:4], 'latitude': rng.uniform(-60, 70),
+                                'longitude': rng.uniform(-180, 180)},
+            'terms': self.terms(key),
+            'genre': [{'name': 'genre %d' % rng.randint(1, 40)}],
+            'doc_counts': dict((doc, self.documents_per_artist) for doc in _DOCUMENT_TYPES),
+            'urls': self.urls(key),
+        }
+        for bucket in buckets:
+            if bucket in fields:
+                a[bucket] = fields[bucket]
+            elif bucket.startswith('id:'):
+                a['foreign_ids'] = [{'catalog': bucket[3:], 'foreign_id': '%s:artist:%s' % (bucket[3:], key)}]
+        return a
+
+    def terms(self, key):
+        rng = _rng(self.seed, 'terms', key)
+        return [{'name': 'term %d' % rng.randint(1, 500), 'frequency': rng.random(), 'weight': rng.random()}
+                for i in xrange(5)]
+
+    def urls(self, key):
+        return {'official_url': 'http://example.com/%s' % key, 'wikipedia_url': 'http://en.wikipedia.org/wiki/%s' % key}
+
+    def audio_summary(self, item_id):
+        rng = _rng(self.seed, 'summary', item_id)
+        return {
+            'key': rng.randint(0, 11), 'mode': rng.randint(0, 1), 'time_signature': rng.choice((3, 4, 4, 4, 5)),
+            'tempo': rng.uniform(60, 200), 'duration': rng.uniform(90, 420), 'loudness': rng.uniform(-30, -2),
+            'danceability': rng.random(), 'energy': rng.random(), 'acousticness': rng.random(),
+            'liveness': rng.random(), 'speechiness': rng.random(), 'valence': rng.random(),
+            'instrumentalness': rng.random(),
+        }
+
+    def song(self, song_id, buckets=()):
+        key = song_id[2:10]
+        rng = _rng(self.seed, 'songdata', song_id)
+        artist = self.artist(key, ['familiarity', 'hotttnesss', 'artist_location'])
+        s = {'id': song_id, 'title': 'Song %s' % song_id[-6:], 'artist_id': artist['id'], 'artist_name': artist['name']}
+        fields = {
+            'audio_summary': self.audio_summary(song_id),
+            'song_hotttnesss': rng.random(),
+            'song_discovery': rng.random(),
+            'song_currency': rng.random(),
+            'song_type': rng.sample(['studio', 'live', 'acoustic', 'electric', 'christmas'], 1),
+            'artist_familiarity': artist['familiarity'],
+            'artist_hotttnesss': artist['hotttnesss'],
+            'artist_location': artist['artist_location'],
+        }
+        for bucket in buckets:
+            if bucket in fields:
+                s[bucket] = fields[bucket]
+            elif bucket.startswith('id:'):
+                s['foreign_ids'] = [{'catalog': bucket[3:], 'foreign_id': '%s:song:%s' % (bucket[3:], song_id)}]
+            elif bucket == 'tracks':
+                s['tracks'] = [{'id': 'TR' + _hash(self.seed, 'track', song_id)[:16], 'catalog': 'mock',
+                                'foreign_id': 'mock:track:%s' % song_id, 'preview_url': 'http://example.com/%s.mp3' % song_id}]
+        return s
+
+    def songs_for_query(self, params, count):
+        # songs for a search or playlist: picked from a pool of artists chosen by the query itself
+        query = sorted((k, v) for (k, v) in params.iteritems() if k not in ('api_key', 'results', 'start', 'bucket'))
+        rng = _rng(self.seed, 'query', query)
+        return [self.song_id(_hash(self.seed, 'pool', rng.randint(0, 999))[:8], rng.randint(0, self.songs_per_artist - 1))
+                for i in xrange(count)]
+
+    def document(self, doc_type, key, n):
+        rng = _rng(self.seed, doc_type, key, n)
+        doc_id = _hash(self.seed, 'doc', doc_type, key, n)[:32].lower()
+        url = 'http://example.com/%s/%s/%d' % (doc_type, key, n)
+        date = '20%02d-%02d-%02dT12:00:00' % (rng.randint(5, 14), rng.randint(1, 12), rng.randint(1, 28))
+        if doc_type == 'biographies':
+            return {'text': 'A made-up biography of artist %s.' % key, 'site': 'example', 'url': url,
+                    'license': {'type': 'cc-by-sa', 'attribution': 'example'}}
+        if doc_type == 'images':
+            return {'url': url + '.jpg', 'license': {'type': 'unknown', 'attribution': 'n/a'}}
+        if doc_type == 'audio':
+            return {'id': doc_id, 'url': url + '.mp3', 'title': 'Track %d' % n, 'artist': key, 'date': date,
+                    'length': rng.uniform(60, 400)}
+        if doc_type == 'video':
+            return {'id': doc_id, 'url': url, 'title': 'Video %d' % n, 'site': 'example', 'date_found': date}
+        return {'id': doc_id, 'name': '%s %d about %s' % (doc_type, n, key), 'url': url, 'date_found': date,
+                'date_posted': date, 'summary': 'A made-up %s entry.' % doc_type}
+
+    def analysis(self, track_id, duration):
+        rng = _rng(self.seed, 'analysis', track_id)
+        summary = self.audio_summary(track_id)
+        beat = 60.0 / summary['tempo']
+
+        def events(step):
+            out, t = [], 0.0
+            while t < duration:
+                out.append({'start': t, 'duration': step, 'confidence': rng.random()})
+                t += step
+            return out
+
+        segments, t = [], 0.0
+        while t < duration:
+            length = rng.uniform(.1, .5)
+            segments.append({
+                'start': t, 'duration': length, 'confidence': rng.random(),
+                'loudness_start': rng.uniform(-60, -5), 'loudness_max_time': rng.uniform(0, length),
+                'loudness_max': rng.uniform(-30, 0),
+                'pitches': [rng.random() for i in xrange(12)], 'timbre': [rng.uniform(-100, 100) for i in xrange(12)],
+            })
+            t += length
+        sections = [dict(e, loudness=rng.uniform(-20, -5), tempo=summary['tempo'], key=summary['key'],
+                         mode=summary['mode'], time_signature=summary['time_signature']) for e in events(30.0)]
+        track = dict(summary, duration=duration, num_samples=int(duration * 22050), sample_md5=_hash(track_id).lower(),
+                     end_of_fade_in=0.0, start_of_fade_out=duration - 5.0, analysis_sample_rate=22050,
+                     analysis_channels=1, tempo_confidence=rng.random(), key_confidence=rng.random(),
+                     mode_confidence=rng.random(), time_signature_confidence=rng.random())
+        return {'meta': {'analyzer_version': '3.2.2', 'platform': 'Linux', 'status_code': 0, 'timestamp': int(time.time())},
+                'track': track, 'bars': events(beat * summary['time_signature']), 'beats': events(beat),
+                'tatums': events(beat / 2), 'sections': sections, 'segments': segments}
+
+_DOCUMENT_TYPES = ('audio', 'biographies', 'blogs', 'images', 'news', 'reviews', 'video')
+
+class MockServer(object):
+    """
+    A local HTTP server that answers the Echo Nest API methods pyechonest calls:
+    artist/*, song/search and song/profile, track/upload and track/profile (tracks stay 'pending' for
+    pending_polls profile calls), catalog/*, playlist/static, playlist/basic, playlist/dynamic/* and
+    sandbox/*. Catalogs, dynamic playlist sessions and uploaded tracks are kept in memory.
+
+    Kwargs:
+        host (str): The interface to listen on
+
+        port (int): The port to listen on; 0 picks a free one (see address)
+
+        latency (float): Seconds to wait before answering, or a (low, high) tuple for a random wait
+
+        error_rate (float): The fraction of requests answered with an HTTP 500 error
+
+        rate_limit (int): Calls allowed per minute before answering with error code 3; None for no limit.
+        The X-RateLimit-Limit, X-RateLimit-Remaining and X-RateLimit-Used headers are always sent.
+
+        pending_polls (int): How many track/profile calls report a new upload as 'pending'
+
+        songs_per_artist (int): How many songs each made-up artist has
+
+        documents_per_artist (int): How many blogs, news, reviews, ... each made-up artist has
+
+        seed: Changes all the made-up data and the error pattern
+
+        compress (bool): gzip (or deflate) responses for clients that send Accept-Encoding
+
+    Example:
+
+    >>> server = mockserver.MockServer(rate_limit=120).start()
+    >>> config.API_HOST = server.address
+    >>> song.search(title='karma police', results=3)
+    [<song - Song 8E0D5C>, <song - Song 1F6A2B>, <song - Song 3C7E9A>]
+    >>> server.requests
+    Counter({'song/search': 1})
+    >>> server.stop()
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0, rate_limit=None, pending_polls=1,
+                 songs_per_artist=50, documents_per_artist=100, seed=0, compress=True):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.pending_polls = pending_polls
+        self.compress = compress
+        self.last_modified = email.utils.formatdate(usegmt=True)
+        self.data = _MockData(seed, songs_per_artist, documents_per_artist)
+        self.requests = collections.Counter()
+        self.catalogs = {}
+        self.sessions = {}
+        self.tracks = {}
+        self._random = random.Random(seed)
+        self._calls = collections.deque()
+        self._lock = threading.RLock()
+        self._server = None
+        self._thread = None
+        self._previous_host = None
+
+    @property
+    def address(self):
+        """host:port of the running server, ready for config.API_HOST"""
+        return '%s:%d' % self._server.server_address[:2]
+
+    def start(self):
+        """Start serving in a background thread; returns the server"""
+        self._server = _ThreadingHTTPServer((self.host, self.port), _MockHandler)
+        self._server.mock = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mockserver')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def __enter__(self):
+        # point pyechonest at the server for the duration of the with block
+        if self._server is None:
+            self.start()
+        self._previous_host = config.API_HOST
+        config.API_HOST = self.address
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        config.API_HOST = self._previous_host
+        self.stop()
+
+    def _delay(self):
+        latency = self.latency
+        if isinstance(latency, (tuple, list)):
+            with self._lock:
+                latency = self._random.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+
+    def _rate_headers(self):
+        now = time.time()
+        with self._lock:
+            while self._calls and self._calls[0] < now - 60:
+                self._calls.popleft()
+            self._calls.append(now)
+            used = len(self._calls)
+        limit = self.rate_limit if self.rate_limit is not None else 1000000
+        headers = {'X-RateLimit-Limit': limit, 'X-RateLimit-Remaining': max(limit - used, 0), 'X-RateLimit-Used': used}
+        return headers, used > limit
+
+    def handle(self, method, params, body):
+        """
+        Answer one API call. Returns (http status, response dict, extra headers); the dict is None when
+        method is not an API call the server knows.
+        """
+        self._delay()
+        with self._lock:
+            self.requests[method] += 1
+            fail = self.error_rate and self._random.random() < self.error_rate
+        headers, limited = self._rate_headers()
+        try:
+            if limited:
+                raise MockAPIError(RATE_LIMITED, "You are limited to %d accesses every minute" % self.rate_limit, 429)
+            if fail:
+                raise MockAPIError(-1, "Simulated server error", 500)
+            handler = getattr(self, '_' + method.replace('/', '_'), None)
+            if handler is None:
+                return 404, None, headers
+            response = handler(params, body)
+            status, http_status = {'code': SUCCESS, 'message': 'Success', 'version': '4.2'}, 200
+        except MockAPIError, e:
+            response = {}
+            status, http_status = {'code': e.code, 'message': e.message, 'version': '4.2'}, e.http_status
+        response['status'] = status
+        return http_status, {'response': response}, headers
+
+    # artist methods
+
+    def _artist_key(self, params):
+        identifier = params.get('id') or params.get('name')
+        if not identifier:
+            raise MockAPIError(MISSING_PARAMETER, "id or name is required")
+        return self.data.artist_key(identifier)
+
+    def _artists(self, keys, params):
+        return [self.data.artist(key, params.getlist('bucket')) for key in keys]
+
+    def _artist_profile(self, params, body):
+        return {'artist': self.data.artist(self._artist_key(params), params.getlist('bucket'))}
+
+    def _artist_familiarity(self, params, body):
+        return {'artist': self.data.artist(self._artist_key(params), ['familiarity'])}
+
+    def _artist_hotttnesss(self, params, body):
+        return {'artist': self.data.artist(self._artist_key(params), ['hotttnesss'])}
+
+    def _artist_twitter(self, params, body):
+        a = self.data.artist(self._artist_key(params))
+        a['twitter'] = 'mock_%s' % a['id'][2:10].lower()
+        return {'artist': a}
+
+    def _artist_urls(self, params, body):
+        return {'urls': self.data.urls(self._artist_key(params))}
+
+    def _artist_terms(self, params, body):
+        return {'terms': self.data.terms(self._artist_key(params))}
+
+    def _artist_similar(self, params, body):
+        keys = [self._artist_key({'id': i}) for i in params.getlist('id')] or \
+               [self.data.artist_key(n) for n in params.getlist('name')]
+        if not keys:
+            raise MockAPIError(MISSING_PARAMETER, "id or name is required")
+        results, start = _as_int(params, 'results', 15), _as_int(params, 'start', 0)
+        similar = [_hash(self.data.seed, 'similar', keys[0], n)[:8] for n in xrange(start, start + results)]
+        return {'artists': self._artists(similar, params)}
+
+    def _artist_search(self, params, body):
+        results, start = _as_int(params, 'results', 15), _as_int(params, 'start', 0)
+        name = params.get('name')
+        if name:
+            keys = [self.data.artist_key(name if n == 0 else '%s %d' % (name, n)) for n in xrange(start, start + results)]
+        else:
+            query = sorted(params.items())
+            keys = [_hash(self.data.seed, 'search', query, n)[:8] for n in xrange(start, start + results)]
+        return {'artists': self._artists(keys, params)}
+
+    def _artist_suggest(self, params, body):
+        q = params.get('q') or params.get('name') or ''
+        results = _as_int(params, 'results', 15)
+        return {'artists': self._artists([self.data.artist_key('%s%s' % (q, suffix)) for suffix in
+                                          ['']  + [' %d' % n for n in xrange(1, results)]], params)}
+
+    def _artist_top_hottt(self, params, body):
+        results, start = _as_int(params, 'results', 15), _as_int(params, 'start', 0)
+        return {'artists': self._artists([_hash(self.data.seed, 'hottt', n)[:8] for n in xrange(start, start + results)], params)}
+
+    def _artist_extract(self, params, body):
+        text = params.get('text') or ''
+        return {'artists': self._artists([self.data.artist_key(w) for w in text.split()[:_as_int(params, 'results', 15)]], params)}
+
+    def _artist_list_terms(self, params, body):
+        return {'terms': [{'name': '%s %d' % (params.get('type', 'style'), n)} for n in xrange(50)]}
+
+    def _artist_top_terms(self, params, body):
+        return {'terms': [{'name': 'term %d' % n, 'frequency': 1.0 - n / 100.0} for n in xrange(_as_int(params, 'results', 15))]}
+
+    def _artist_list_genres(self, params, body):
+        return {'genres': [{'name': 'genre %d' % n} for n in xrange(40)]}
+
+    def _artist_songs(self, params, body):
+        key = self._artist_key(params)
+        results, start = _as_int(params, 'results', 15), _as_int(params, 'start', 0)
+        stop = min(start + results, self.data.songs_per_artist)
+        return {'songs': [self.data.song(self.data.song_id(key, n)) for n in xrange(start, stop)],
+                'start': start, 'total': self.data.songs_per_artist}
+
+    def _documents(self, doc_type, params):
+        key = self._artist_key(params)
+        results, start = _as_int(params, 'results', 15), _as_int(params, 'start', 0)
+        stop = min(start + results, self.data.documents_per_artist)
+        return {doc_type: [self.data.document(doc_type, key, n) for n in xrange(start, stop)],
+                'start': start, 'total': self.data.documents_per_artist}
+
+    # song methods
+
+    def _song_profile(self, params, body):
+        ids = params.getlist('id')
+        if not ids and params.get('track_id'):
+            ids = ['SO' + _hash(self.data.seed, 'track-song', t)[:16] for t in params.getlist('track_id')]
+        if not ids:
+            raise MockAPIError(MISSING_PARAMETER, "id or track_id is required")
+        return {'songs': [self.data.song(song_id, params.getlist('bucket')) for song_id in ids]}
+
+    def _song_search(self, params, body):
+        results, start = _as_int(params, 'results', 15), _as_int(params, 'start', 0)
+        ids = self.data.songs_for_query(params, start + results)[start:]
+        return {'songs': [self.data.song(song_id, params.getlist('bucket')) for song_id in ids]}
+
+    # track methods
+
+    def _track_upload(self, params, body):
+        source = params.get('url') or body
+        if not source:
+            raise MockAPIError(MISSING_PARAMETER, "url or a request body is required")
+        md5 = hashlib.md5(source).hexdigest()
+        track_id = 'TR' + md5[:16].upper()
+        with self._lock:
+            if track_id not in self.tracks:
+                self.tracks[track_id] = {'md5': md5, 'polls_left': self.pending_polls,
+                                         'filetype': params.get('filetype', 'mp3')}
+        return {'track': self._track_status(track_id, poll=False)}
+
+    def _track_profile(self, params, body):
+        track_id = params.get('id')
+        if track_id is None and params.get('md5'):
+            with self._lock:
+                track_id = next((t for (t, d) in self.tracks.iteritems() if d['md5'] == params.get('md5')), None)
+        if track_id is None or track_id not in self.tracks:
+            raise MockAPIError(INVALID_PARAMETER, "The Identifier specified does not exist: %s" %
+                               (params.get('id') or params.get('md5')))
+        return {'track': self._track_status(track_id)}
+
+    def _track_status(self, track_id, poll=True):
+        with self._lock:
+            state = self.tracks[track_id]
+            pending = state['polls_left'] > 0
+            if poll and pending:
+                state['polls_left'] -= 1
+        track = {'id': track_id, 'md5': state['md5'], 'status': 'pending' if pending else 'complete'}
+        if not pending:
+            summary = self.data.audio_summary(track_id)
+            summary['analysis_url'] = 'http://%s/analysis/%s' % (self.address, track_id)
+            track.update(audio_summary=summary, artist='Artist %s' % track_id[2:8], title='Track %s' % track_id[-6:],
+                         analyzer_version='3.2.2', bitrate=128, samplerate=44100, audio_md5=state['md5'],
+                         status_code=0, sample_rate=44100)
+        return track
+
+    def analysis(self, track_id):
+        """The detailed analysis document served at a complete track's analysis_url"""
+        if track_id not in self.tracks:
+            return None
+        return self.data.analysis(track_id, self.data.audio_summary(track_id)['duration'])
+
+    # catalog methods
+
+    def _catalog(self, params):
+        with self._lock:
+            if params.get('id') in self.catalogs:
+                return self.catalogs[params.get('id')]
+            for c in self.catalogs.itervalues():
+                if params.get('name') and c['name'] == params.get('name'):
+                    return c
+        raise MockAPIError(INVALID_PARAMETER, "This catalog does not exist")
+
+    def _catalog_create(self, params, body):
+        name, catalog_type = params.get('name'), params.get('type', 'general')
+        if not name:
+            raise MockAPIError(MISSING_PARAMETER, "name is required")
+        with self._lock:
+            for c in self.catalogs.itervalues():
+                if c['name'] == name:
+                    raise MockAPIError(INVALID_PARAMETER, "A catalog with this name already exists")
+            catalog_id = 'CA' + _hash(self.data.seed, 'catalog', name)[:16]
+            self.catalogs[catalog_id] = {'id': catalog_id, 'name': name, 'type': catalog_type, 'items': collections.OrderedDict(),
+                                         'tickets': []}
+        return {'id': catalog_id, 'name': name, 'type': catalog_type}
+
+    def _catalog_summary(self, c):
+        return {'id': c['id'], 'name': c['name'], 'type': c['type'], 'total': len(c['items']),
+                'pending_tickets': [], 'resolved': len(c['items'])}
+
+    def _catalog_profile(self, params, body):
+        return {'catalog': self._catalog_summary(self._catalog(params))}
+
+    def _catalog_update(self, params, body):
+        c = self._catalog(params)
+        try:
+            items = json.loads(params.get('data') or '[]')
+        except ValueError:
+            raise MockAPIError(INVALID_PARAMETER, "data is not valid JSON")
+        with self._lock:
+            for entry in items:
+                action, item = entry.get('action', 'update'), entry.get('item', {})
+                if action == 'delete':
+                    c['items'].pop(item.get('item_id'), None)
+                else:
+                    c['items'][item.get('item_id')] = item
+            ticket = _hash(self.data.seed, 'ticket', c['id'], len(c['tickets']))[:32].lower()
+            c['tickets'].append(ticket)
+        return {'ticket': ticket}
+
+    def _catalog_status(self, params, body):
+        return {'ticket_status': 'complete', 'update_info': [], 'items_updated': 0}
+
+    def _catalog_item(self, c, item):
+        out = {'request': item, 'date_added': '2013-01-01T00:00:00',
+               'foreign_id': '%s:%s:%s' % (c['id'], c['type'], item.get('item_id'))}
+        if item.get('song_id') or item.get('song_name'):
+            song_id = item.get('song_id') or self.data.song_id(self.data.artist_key(item.get('artist_name') or 'unknown'),
+                                                               int(_hash(item.get('song_name'))[:4], 16) % self.data.songs_per_artist)
+            s = self.data.song(song_id)
+            out.update(song_id=s['id'], song_name=item.get('song_name') or s['title'], artist_id=s['artist_id'],
+                       artist_name=s['artist_name'])
+        elif item.get('artist_id') or item.get('artist_name'):
+            a = self.data.artist(self.data.artist_key(item.get('artist_id') or item.get('artist_name')))
+            out.update(artist_id=a['id'], artist_name=a['name'])
+        return out
+
+    def _catalog_read(self, params, body):
+        c = self._catalog(params)
+        results, start = _as_int(params, 'results', 15), _as_int(params, 'start', 0)
+        with self._lock:
+            item_ids = params.getlist('item_id')
+            items = [c['items'][i] for i in item_ids if i in c['items']] if item_ids else c['items'].values()[start:start + results]
+            catalog = self._catalog_summary(c)
+        catalog.update(items=[self._catalog_item(c, item) for item in items], start=start)
+        return {'catalog': catalog}
+
+    def _catalog_feed(self, params, body):
+        c = self._catalog(params)
+        results, start = _as_int(params, 'results', 15), _as_int(params, 'start', 0)
+        doc_types = params.getlist('bucket') or ['news', 'blogs', 'reviews']
+        feed = []
+        with self._lock:
+            items = c['items'].values()
+        for n in xrange(start, start + results):
+            if not items:
+                break
+            item = self._catalog_item(c, items[n % len(items)])
+            if 'artist_id' not in item:
+                continue
+            doc_type = doc_types[n % len(doc_types)]
+            doc = self.data.document(doc_type, item['artist_id'][2:10], n)
+            doc.update(type=doc_type, references=[{'artist_id': item['artist_id'], 'artist_name': item['artist_name']}])
+            feed.append(doc)
+        return {'feed': feed}
+
+    def _catalog_delete(self, params, body):
+        c = self._catalog(params)
+        with self._lock:
+            del self.catalogs[c['id']]
+        return {'id': c['id'], 'name': c['name']}
+
+    def _catalog_list(self, params, body):
+        results, start = _as_int(params, 'results', 30), _as_int(params, 'start', 0)
+        with self._lock:
+            catalogs = [self._catalog_summary(c) for c in self.catalogs.itervalues()]
+        return {'catalogs': catalogs[start:start + results], 'start': start, 'total': len(catalogs)}
+
+    def _catalog_keyvalues(self, params, body):
+        return {'keyvalues': {}}
+
+    def _catalog_item_action(self, params, body):
+        self._catalog(params)
+        return {}
+
+    _catalog_play = _catalog_skip = _catalog_favorite = _catalog_ban = _catalog_rate = _catalog_item_action
+
+    # playlist methods
+
+    def _playlist_static(self, params, body):
+        if not (params.get('artist') or params.get('artist_id') or params.get('song_id') or params.get('genre') or
+                params.get('seed_catalog') or params.get('description') or params.get('style') or params.get('mood')):
+            raise MockAPIError(MISSING_PARAMETER, "a seed is required")
+        ids = self.data.songs_for_query(params, _as_int(params, 'results', 15))
+        return {'songs': [self.data.song(song_id, params.getlist('bucket')) for song_id in ids]}
+
+    _playlist_basic = _playlist_static
+
+    def _session(self, params):
+        session_id = params.get('session_id')
+        with self._lock:
+            if session_id not in self.sessions:
+                raise MockAPIError(INVALID_PARAMETER, "The session does not exist: %s" % session_id)
+            return self.sessions[session_id]
+
+    def _playlist_dynamic_create(self, params, body):
+        with self._lock:
+            session_id = _hash(self.data.seed, 'session', len(self.sessions), time.time())[:32].lower()
+            self.sessions[session_id] = {'params': params, 'played': 0, 'history': []}
+        return {'session_id': session_id}
+
+    def _playlist_dynamic_restart(self, params, body):
+        with self._lock:
+            session = self._session(params)
+            session.update(params=params, played=0, history=[])
+        return {'session_id': params.get('session_id')}
+
+    def _playlist_dynamic_next(self, params, body):
+        results, lookahead = _as_int(params, 'results', 1), _as_int(params, 'lookahead', 0)
+        with self._lock:
+            session = self._session(params)
+            start = session['played']
+            session['played'] += results
+        ids = self.data.songs_for_query(dict(session['params'].items(), session=params.get('session_id')),
+                                        start + results + lookahead)
+        songs = [self.data.song(song_id, session['params'].getlist('bucket')) for song_id in ids[start:]]
+        with self._lock:
+            session['history'].extend(s['id'] for s in songs[:results])
+        return {'songs': songs[:results], 'lookahead': songs[results:]}
+
+    def _playlist_dynamic_info(self, params, body):
+        session = self._session(params)
+        with self._lock:
+            history = list(session['history'])
+        return {'session_id': params.get('session_id'), 'history': [{'id': song_id} for song_id in history],
+                'terms': [], 'rules': [], 'skipped_songs': [], 'banned_artists': []}
+
+    def _playlist_dynamic_delete(self, params, body):
+        self._session(params)
+        with self._lock:
+            del self.sessions[params.get('session_id')]
+        return {}
+
+    def _playlist_dynamic_steer(self, params, body):
+        self._session(params)
+        return {}
+
+    _playlist_dynamic_feedback = _playlist_dynamic_steer
+
+    # sandbox methods
+
+    def _sandbox_list(self, params, body):
+        results, start = _as_int(params, 'results', 15), _as_int(params, 'start', 0)
+        total = 100
+        return {'assets': [{'id': str(n), 'filename': 'asset-%d.mp3' % n, 'title': 'Asset %d' % n}
+                           for n in xrange(start, min(start + results, total))], 'start': start, 'total': total}
+
+    def _sandbox_access(self, params, body):
+        return {'assets': [{'id': asset_id, 'url': 'http://example.com/%s/%s.mp3' % (params.get('sandbox'), asset_id)}
+                           for asset_id in params.getlist('id')]}
+
+def _document_method(doc_type):
+    return lambda self, params, body: self._documents(doc_type, params)
+
+for _doc_type in _DOCUMENT_TYPES:
+    setattr(MockServer, '_artist_' + _doc_type, _document_method(_doc_type))
+
+
+class _Params(dict):
+    """Query and form parameters: the first value of each, with getlist for repeated ones"""
+    def __init__(self, lists):
+        super(_Params, self).__init__((k, v[0]) for (k, v) in lists.iteritems())
+        self.lists = lists
+
+    def getlist(self, key):
+        return self.lists.get(key, [])
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _MockHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self._answer('')
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.getheader('content-length') or 0))
+        self._answer(body)
+
+    def _answer(self, body):
+        mock = self.server.mock
+        url = urlparse.urlsplit(self.path)
+        lists = urlparse.parse_qs(url.query, keep_blank_values=True)
+        if body and self.headers.getheader('content-type', '').startswith('application/x-www-form-urlencoded'):
+            for (k, v) in urlparse.parse_qs(body, keep_blank_values=True).iteritems():
+                lists.setdefault(k, []).extend(v)
+            body = ''
+        prefix = '/%s/%s/' % (config.API_SELECTOR, config.API_VERSION)
+        if url.path.startswith('/analysis/'):
+            http_status, document, headers = 200, mock.analysis(url.path[len('/analysis/'):]), {}
+            if document is None:
+                http_status = 404
+        elif url.path.startswith(prefix):
+            http_status, document, headers = mock.handle(url.path[len(prefix):], _Params(lists), body)
+        else:
+            http_status, document, headers = 404, None, {}
+        payload = json.dumps(document) if document is not None else 'Not Found'
+        if self.command == 'GET' and http_status == 200 and document is not None:
+            # validators, so clients can revalidate what they cached with a conditional GET
+            headers['ETag'] = '"%s"' % hashlib.md5(payload).hexdigest()
+            headers['Last-Modified'] = mock.last_modified
+            if self.headers.getheader('if-none-match') == headers['ETag'] or (
+                    not self.headers.getheader('if-none-match') and
+                    self.headers.getheader('if-modified-since') == mock.last_modified):
+                http_status, payload = 304, ''
+        accepted = [e.split(';')[0].strip() for e in self.headers.getheader('accept-encoding', '').split(',')
+                    if payload]
+        encoding = None
+        if mock.compress and 'gzip' in accepted:
+            encoding = 'gzip'
+            buf = StringIO.StringIO()
+            gz = gzip.GzipFile(fileobj=buf, mode='wb')
+            gz.write(payload)
+            gz.close()
+            payload = buf.getvalue()
+        elif mock.compress and 'deflate' in accepted:
+            encoding = 'deflate'
+            payload = zlib.compress(payload)
+        self.send_response(http_status)
+        self.send_header('Content-Type', 'application/json' if document is not None else 'text/plain')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(payload)))
+        for (k, v) in headers.iteritems():
+            self.send_header(k, str(v))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        if config.TRACE_API_CALLS:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage="%prog [options]", description="Run a local mock Echo Nest API server")
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=8080)
+    parser.add_option('--latency', type='float', default=0.0, help="seconds to wait before each answer")
+    parser.add_option('--error-rate', type='float', default=0.0, help="fraction of requests that fail with HTTP 500")
+    parser.add_option('--rate-limit', type='int', default=None, help="calls allowed per minute")
+    parser.add_option('--pending-polls', type='int', default=1, help="track/profile calls a new upload stays pending for")
+    parser.add_option('--seed', default=0)
+    parser.add_option('--no-compress', action='store_true', help="never gzip or deflate responses")
+    options, args = parser.parse_args(argv)
+    server = MockServer(options.host, options.port, options.latency, options.error_rate, options.rate_limit,
+                        options.pending_polls, seed=options.seed, compress=not options.no_compress).start()
+    print "Mock Echo Nest API on %s (set config.API_HOST = '%s')" % (server.address, server.address)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == '__main__':
+    main()
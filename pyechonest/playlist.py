@@ -13,6 +13,12 @@ import util
 from proxies import PlaylistProxy
 from song import Song
 import catalog
+import config
+import collections
+import inspect
+import math
+import threading
+import time
 import logging
 logger = logging.getLogger(__name__)
 
@@ -55,7 +61,7 @@ def basic(type='artist-radio', artist_id=None, artist=None, song_id=None, song=N
     del kwargs['genres']
 
     result = util.callm("%s/%s" % ('playlist', 'basic'), kwargs)
-    return [Song(**util.fix(s_dict)) for s_dict in result['response']['songs']]
+    return [Song.from_response(s_dict) for s_dict in result['response']['songs']]
 
 
 def static(type='artist', artist_pick='song_hotttnesss-desc', variety=.5, artist_id=None, artist=None, song_id=None,
@@ -206,7 +212,178 @@ def static(type='artist', artist_pick='song_hotttnesss-desc', variety=.5, artist
     del kwargs['genres']
 
     result = util.callm("%s/%s" % ('playlist', 'static'), kwargs)
-    return [Song(**util.fix(s_dict)) for s_dict in result['response']['songs']]
+    return [Song.from_response(s_dict) for s_dict in result['response']['songs']]
+
+# song features that local_static can filter, pick and sort on, and where they live in a song dict
+_LOCAL_SUMMARY_FEATURES = ('tempo', 'duration', 'loudness', 'danceability', 'energy', 'mode', 'key',
+                           'acousticness', 'liveness', 'speechiness', 'valence')
+_LOCAL_SONG_FEATURES = ('song_hotttnesss', 'artist_familiarity', 'artist_hotttnesss')
+# rough ranges used to put features on a common scale when comparing artists to the seeds
+_LOCAL_SIMILARITY_SCALES = {'tempo': 250.0, 'loudness': 60.0, 'danceability': 1.0, 'energy': 1.0,
+                            'acousticness': 1.0, 'valence': 1.0}
+_LOCAL_IGNORED_ARGS = ('buckets', 'limit', 'dmca')
+
+def _local_song_dict(s):
+    if isinstance(s, Song):
+        d = dict(s.cache)
+        d.update(id=s.id, title=s.title, artist_name=s.artist_name, artist_id=s.artist_id)
+        return d
+    return s
+
+def _local_feature(d, name):
+    if name in ('latitude', 'longitude'):
+        return (d.get('artist_location') or {}).get(name)
+    if name in d:
+        return d[name]
+    return (d.get('audio_summary') or {}).get(name)
+
+def _local_order(spec):
+    # 'tempo-asc' -> ('tempo', False)
+    field, _, direction = spec.rpartition('-')
+    if not field or direction not in ('asc', 'desc'):
+        raise ValueError("Sort order must look like 'field-asc' or 'field-desc', got %r" % (spec,))
+    return field, direction == 'desc'
+
+def _local_sorted(songs, spec):
+    field, reverse = _local_order(spec)
+    present = [s for s in songs if _local_feature(s, field) is not None]
+    missing = [s for s in songs if _local_feature(s, field) is None]
+    return sorted(present, key=lambda s: _local_feature(s, field), reverse=reverse) + missing
+
+def _local_as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+def local_static(songs, type='artist', artist_pick='song_hotttnesss-desc', variety=.5, artist_id=None, artist=None,
+                 song_id=None, results=15, max_tempo=None, min_tempo=None, max_duration=None, min_duration=None,
+                 max_loudness=None, min_loudness=None, max_danceability=None, min_danceability=None, max_energy=None,
+                 min_energy=None, artist_max_familiarity=None, artist_min_familiarity=None, artist_max_hotttnesss=None,
+                 artist_min_hotttnesss=None, song_max_hotttnesss=None, song_min_hotttnesss=None, min_longitude=None,
+                 max_longitude=None, min_latitude=None, max_latitude=None, mode=None, key=None, sort=None,
+                 distribution=None, **kwargs):
+    """Build a static playlist locally from songs whose features are already in memory
+    
+    This takes the same arguments as static (plus the songs to choose from) but never calls the API.
+    Arguments that need data which is not in a song table (description, style, mood, catalogs, ...)
+    raise a ValueError, so callers can fall back to static. buckets, limit and dmca are accepted and ignored.
+    
+    For the radio types, artists are ranked by how close their songs' audio summaries are to the seed songs;
+    there is no artist similarity data in a song table.
+    
+    Args:
+        songs (list): Song objects or song dicts as returned by the API, e.g. from song.profile or
+        song.search with the audio_summary, song_hotttnesss and artist_familiarity buckets
+    
+    Kwargs:
+        type (str): 'artist', 'artist-radio' or 'song-radio'
+        
+        artist_pick (str): How songs should be chosen for each artist, e.g. 'song_hotttnesss-desc' or 'tempo-asc'
+        
+        variety (float): A number between 0 and 1; higher values spread the playlist over more artists
+        
+        distribution (str): 'focused' fills the playlist from the closest artists first, 'wandering' (the default)
+        takes turns between artists
+        
+        sort (str): A string indicating an attribute and order for sorting the results, e.g. 'tempo-asc'
+    
+        All other kwargs are the same as for static.
+    
+    Returns:
+        A list of Song objects
+    
+    Example:
+    
+    >>> songs = song.profile(song_ids, buckets=['audio_summary', 'song_hotttnesss'])
+    >>> playlist.local_static(songs, type='artist-radio', artist='weezer', min_tempo=120, sort='tempo-asc', results=5)
+    [<song - Buddy Holly>, <song - Hash Pipe>, <song - Beverly Hills>, <song - Pork and Beans>, <song - El Scorcho>]
+    >>> 
+    """
+    unsupported = sorted(k for (k, v) in kwargs.iteritems() if k not in _LOCAL_IGNORED_ARGS and v is not None)
+    if unsupported:
+        raise ValueError("Cannot build a local playlist with: %s" % ', '.join(unsupported))
+    if type not in ('artist', 'artist-radio', 'song-radio'):
+        raise ValueError("Cannot build a local playlist of type %r" % (type,))
+
+    table = [_local_song_dict(s) for s in songs]
+    seed_artist_ids = set(_local_as_list(artist_id))
+    seed_names = set(n.lower() for n in _local_as_list(artist))
+    seed_song_ids = set(_local_as_list(song_id))
+    seeds = [d for d in table if d.get('artist_id') in seed_artist_ids or d['id'] in seed_song_ids or
+             (d.get('artist_name') or '').lower() in seed_names]
+    if not seeds:
+        raise ValueError("None of the seed artists or songs are in the song table")
+    seed_artist_ids.update(d.get('artist_id') for d in seeds)
+
+    ranges = (
+        ('tempo', min_tempo, max_tempo),
+        ('duration', min_duration, max_duration),
+        ('loudness', min_loudness, max_loudness),
+        ('danceability', min_danceability, max_danceability),
+        ('energy', min_energy, max_energy),
+        ('artist_familiarity', artist_min_familiarity, artist_max_familiarity),
+        ('artist_hotttnesss', artist_min_hotttnesss, artist_max_hotttnesss),
+        ('song_hotttnesss', song_min_hotttnesss, song_max_hotttnesss),
+        ('latitude', min_latitude, max_latitude),
+        ('longitude', min_longitude, max_longitude),
+        ('mode', mode, mode),
+        ('key', key, key),
+    )
+    ranges = [r for r in ranges if r[1] is not None or r[2] is not None]
+
+    def matches(d):
+        for field, low, high in ranges:
+            value = _local_feature(d, field)
+            if value is None or (low is not None and value < low) or (high is not None and value > high):
+                return False
+        return True
+
+    by_artist = {}
+    for d in table:
+        if type == 'artist' and d.get('artist_id') not in seed_artist_ids:
+            continue
+        if matches(d):
+            by_artist.setdefault(d.get('artist_id'), []).append(d)
+
+    # seed artists first, then everyone else by distance from the seed songs' average sound
+    def centroid(ds):
+        center = {}
+        for field in _LOCAL_SIMILARITY_SCALES:
+            values = [_local_feature(d, field) for d in ds if _local_feature(d, field) is not None]
+            if values:
+                center[field] = sum(values) / float(len(values))
+        return center
+    seed_center = centroid(seeds)
+
+    def distance(artist_songs):
+        center = centroid(artist_songs)
+        shared = [f for f in seed_center if f in center]
+        if not shared:
+            return float('inf')
+        return sum(((center[f] - seed_center[f]) / _LOCAL_SIMILARITY_SCALES[f]) ** 2 for f in shared) / len(shared)
+
+    artist_ids = sorted(by_artist, key=lambda a: (a not in seed_artist_ids, distance(by_artist[a]), a))
+    if type == 'artist':
+        per_artist = results
+    else:
+        per_artist = max(1, int(math.ceil(results * (1.0 - variety))))
+    picks = [_local_sorted(by_artist[a], artist_pick)[:per_artist] for a in artist_ids]
+
+    playlist = []
+    if distribution == 'focused':
+        for artist_songs in picks:
+            playlist.extend(artist_songs[:results - len(playlist)])
+            if len(playlist) >= results:
+                break
+    else:
+        for turn in xrange(per_artist):
+            for artist_songs in picks:
+                if turn < len(artist_songs) and len(playlist) < results:
+                    playlist.append(artist_songs[turn])
+
+    if sort:
+        playlist = _local_sorted(playlist, sort)
+    return [Song.from_response(d) for d in playlist]
 
 class Playlist(PlaylistProxy):
     """
@@ -304,7 +481,7 @@ class Playlist(PlaylistProxy):
         self.cache['lookahead'] = response['lookahead']
         if len(self.cache['songs']):
             songs = self.cache['songs'][:]
-            songs = [Song(**util.fix(song)) for song in songs]
+            songs = [Song.from_response(song) for song in songs]
             return songs
         else:
             return None
@@ -314,7 +491,7 @@ class Playlist(PlaylistProxy):
             self.get_next_songs(results=1)
         if len(self.cache['songs']):
             songs = self.cache['songs'][:]
-            songs = [Song(**util.fix(song)) for song in songs]
+            songs = [Song.from_response(song) for song in songs]
 
             return songs
         else:
@@ -325,7 +502,7 @@ class Playlist(PlaylistProxy):
             return None
         if len(self.cache['lookahead']):
             lookahead = self.cache['lookahead'][:]
-            lookahead = [Song(**util.fix(song)) for song in lookahead]
+            lookahead = [Song.from_response(song) for song in lookahead]
 
             return lookahead
         else:
@@ -561,6 +738,356 @@ class Playlist(PlaylistProxy):
         self.cache['lookahead'] = []
         return True
 
+class PrefetchTimeout(util.EchoNestException):
+    """No song arrived in a PrefetchingPlaylist's buffer within its wait_timeout"""
+    def __init__(self, message):
+        super(PrefetchTimeout, self).__init__(-1, message, None)
+
+class PrefetchingPlaylist(Playlist):
+    """
+    A Dynamic Playlist that keeps a buffer of upcoming songs filled from a background thread,
+    so get_next_songs is answered from memory instead of waiting on a playlist/dynamic/next call.
+
+    Songs sitting in the buffer have already been handed out by the API, so steering or giving
+    feedback throws the buffer away and refills it from the re-steered session.
+
+    Kwargs:
+        buffer_size (int): The number of upcoming songs to keep buffered
+
+        fetch_size (int): The maximum number of songs to ask for in each background next call
+
+        wait_timeout (float): How long (seconds) get_next_songs waits on an empty buffer before raising
+        PrefetchTimeout; defaults to config.CALL_TIMEOUT
+
+    All other arguments are the same as for Playlist.
+
+    The background thread keeps the playlist alive until close() is called, so call it when done,
+    or use the playlist as a context manager.
+
+    Example:
+
+    >>> with playlist.PrefetchingPlaylist(type='artist-radio', artist=['ida maria'], buffer_size=10) as p:
+    ...     p.get_next_songs()
+    ...
+    [<song - Stella & God>]
+    """
+
+    def __init__(self, session_id=None, buffer_size=10, fetch_size=5, wait_timeout=None, **kwargs):
+        super(PrefetchingPlaylist, self).__init__(session_id=session_id, **kwargs)
+        self.buffer_size = max(1, buffer_size)
+        self.fetch_size = max(1, min(fetch_size, self.buffer_size))
+        self.wait_timeout = wait_timeout
+        self._buffer = collections.deque()
+        self._condition = threading.Condition()
+        self._generation = 0
+        self._exhausted = False
+        self._error = None
+        self._closed = False
+        self._thread = util.start_thread(self._fill_buffer, 'playlist-prefetch-%s' % self.session_id)
+
+    def __repr__(self):
+        return "<Prefetching Dynamic Playlist - %s>" % self.session_id.encode('utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def _fill_buffer(self):
+        while True:
+            with self._condition:
+                while not self._closed and (self._exhausted or self._error is not None or
+                                            len(self._buffer) >= self.buffer_size):
+                    self._condition.wait()
+                if self._closed:
+                    return
+                generation = self._generation
+                results = min(self.fetch_size, self.buffer_size - len(self._buffer))
+            try:
+                response = self.get_attribute(method='next', session_id=self.session_id, results=results)
+            except Exception, e:
+                logger.debug("prefetch for %s failed: %s" % (self.session_id, e))
+                with self._condition:
+                    if generation == self._generation:
+                        self._error = e
+                    self._condition.notify_all()
+                continue
+            with self._condition:
+                if generation != self._generation:
+                    # steered or fed back while the call was in flight; these songs are stale
+                    continue
+                if response['songs']:
+                    self._buffer.extend(response['songs'])
+                else:
+                    self._exhausted = True
+                self._condition.notify_all()
+
+    def _reset_buffer(self):
+        with self._condition:
+            self._generation += 1
+            self._buffer.clear()
+            self._exhausted = False
+            self._error = None
+            self._condition.notify_all()
+
+    def get_next_songs(self, results=None, lookahead=None):
+        """Get the next songs in the playlist from the prefetch buffer
+
+        Kwargs:
+            results (int): The number of songs to return; defaults to 1
+
+            lookahead (int): Ignored; the buffered songs are available from get_lookahead_songs
+
+        Returns:
+            A list of Song objects, or None if the session has run out of songs or the playlist was
+            closed. The buffer never holds more than buffer_size songs, so at most that many are
+            returned, and fewer if wait_timeout ran out first
+
+        Raises:
+            PrefetchTimeout: if no song arrived within wait_timeout
+        """
+        results = results or 1
+        timeout = self.wait_timeout if self.wait_timeout is not None else config.CALL_TIMEOUT
+        deadline = time.time() + timeout
+        wanted = min(results, self.buffer_size)
+        with self._condition:
+            while (len(self._buffer) < wanted and not self._exhausted and self._error is None
+                   and not self._closed):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            if not self._buffer and self._error is not None:
+                error, self._error = self._error, None
+                self._condition.notify_all()
+                raise error
+            if not self._buffer and not (self._exhausted or self._closed):
+                raise PrefetchTimeout("No songs for playlist session %s after %ss" % (self.session_id, timeout))
+            songs = [self._buffer.popleft() for i in xrange(min(results, len(self._buffer)))]
+            self.cache['songs'] = songs
+            self.cache['lookahead'] = list(self._buffer)
+            self._condition.notify_all()
+        if songs:
+            return [Song.from_response(song) for song in songs]
+        else:
+            return None
+
+    def get_lookahead_songs(self):
+        with self._condition:
+            lookahead = list(self._buffer)
+        if lookahead:
+            return [Song.from_response(song) for song in lookahead]
+        else:
+            return None
+
+    def steer(self, *args, **kwargs):
+        result = super(PrefetchingPlaylist, self).steer(*args, **kwargs)
+        self._reset_buffer()
+        return result
+
+    def feedback(self, *args, **kwargs):
+        result = super(PrefetchingPlaylist, self).feedback(*args, **kwargs)
+        self._reset_buffer()
+        return result
+
+    def restart(self, *args, **kwargs):
+        result = super(PrefetchingPlaylist, self).restart(*args, **kwargs)
+        self._reset_buffer()
+        return result
+
+    def close(self):
+        """Stop the background prefetch thread; the session itself is left alone"""
+        with self._condition:
+            self._closed = True
+            self._buffer.clear()
+            self._condition.notify_all()
+
+    def delete(self):
+        self.close()
+        return super(PrefetchingPlaylist, self).delete()
+
+_restart_args = inspect.getargspec(Playlist.restart).args
+
+class PlaylistPool(object):
+    """
+    A pool of warm dynamic playlist sessions, kept per seed template.
+
+    Creating a Playlist costs a playlist/dynamic/create call. The pool creates sessions ahead of time
+    from a background thread, so acquire is a dictionary lookup as long as the pool keeps up with demand.
+    Sessions older than max_age are deleted (by the background thread) rather than handed out.
+
+    Kwargs:
+        size (int): The default number of idle sessions to keep per template
+
+        max_age (float): Seconds after creation when an idle session is considered expired; None never expires
+
+        playlist_class (class): The class used to create sessions, e.g. Playlist or PrefetchingPlaylist
+
+        replenish_interval (float): Seconds between background checks for expired sessions
+
+    Example:
+
+    >>> pool = playlist.PlaylistPool(size=20, max_age=3600)
+    >>> pool.add_template('indie', type='genre-radio', genres=['indie rock'], buckets=['id:7digital-US'])
+    >>> p = pool.acquire('indie')
+    >>> p.get_next_songs()
+    [<song - Maps>]
+    >>> pool.release(p, 'indie')
+    >>> pool.close()
+    """
+
+    def __init__(self, size=5, max_age=None, playlist_class=Playlist, replenish_interval=5.0):
+        self.size = size
+        self.max_age = max_age
+        self.playlist_class = playlist_class
+        self.replenish_interval = replenish_interval
+        self._templates = {}
+        self._sizes = {}
+        self._idle = {}
+        self._retired = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = util.start_thread(self._replenish, 'playlist-pool')
+
+    def add_template(self, name, size=None, **kwargs):
+        """Register a seed template; kwargs are passed to the playlist constructor (type, artist_id, genres, buckets, ...)"""
+        with self._condition:
+            self._templates[name] = kwargs
+            self._sizes[name] = self.size if size is None else size
+            self._idle.setdefault(name, collections.deque())
+            self._condition.notify_all()
+
+    def remove_template(self, name):
+        """Stop pooling a template and delete its idle sessions"""
+        with self._condition:
+            self._templates.pop(name, None)
+            self._sizes.pop(name, None)
+            idle = self._idle.pop(name, collections.deque())
+        for created, p in idle:
+            self._discard(p)
+
+    def _expired(self, created, now=None):
+        return self.max_age is not None and (now or time.time()) - created > self.max_age
+
+    def _discard(self, p):
+        try:
+            p.delete()
+        except util.EchoNestException, e:
+            # expired sessions may already be gone on the server side
+            logger.debug("could not delete playlist session %s: %s" % (p.session_id, e))
+
+    def _create(self, name):
+        return self.playlist_class(**self._templates[name])
+
+    def acquire(self, name):
+        """Take a session for a template out of the pool, creating one synchronously if the pool is empty
+
+        Args:
+            name (str): The template name given to add_template
+
+        Returns:
+            A Playlist object
+
+        Raises:
+            ValueError: if no template has that name
+
+        Once the pool is closed, every session is created synchronously.
+        """
+        p = None
+        with self._condition:
+            if name not in self._templates:
+                raise ValueError("No playlist template named %r; add it with add_template" % (name,))
+            idle = self._idle.get(name, ())
+            now = time.time()
+            while idle:
+                created, candidate = idle.popleft()
+                if self._expired(created, now):
+                    # deleting costs a round trip; leave that to the replenishing thread
+                    self._retired.append(candidate)
+                else:
+                    p = candidate
+                    break
+            self._condition.notify_all()
+        if p is None:
+            p = self._create(name)
+        return p
+
+    def release(self, playlist, name=None):
+        """Hand a session back.
+
+        With a template name the session is restarted with the template seeds and returned to that
+        template's idle sessions (if there is room); otherwise it is deleted.
+        """
+        if name is not None:
+            with self._condition:
+                template = self._templates.get(name)
+                room = template is not None and name in self._idle and len(self._idle[name]) < self._sizes[name]
+            if room:
+                try:
+                    playlist.restart(**dict((k, v) for (k, v) in template.iteritems() if k in _restart_args))
+                except util.EchoNestException, e:
+                    logger.debug("could not restart playlist session %s: %s" % (playlist.session_id, e))
+                else:
+                    with self._condition:
+                        if name in self._idle:
+                            self._idle[name].append((time.time(), playlist))
+                            return
+        self._discard(playlist)
+
+    def stats(self):
+        """Returns a dict mapping template names to the number of idle sessions"""
+        with self._condition:
+            return dict((name, len(idle)) for name, idle in self._idle.iteritems())
+
+    def _replenish(self):
+        while True:
+            wanted = None
+            with self._condition:
+                if self._closed:
+                    return
+                expired, self._retired = self._retired, []
+                now = time.time()
+                for name, idle in self._idle.iteritems():
+                    while idle and self._expired(idle[0][0], now):
+                        expired.append(idle.popleft()[1])
+                    if wanted is None and len(idle) < self._sizes[name]:
+                        wanted = name
+                if wanted is None and not expired:
+                    self._condition.wait(self.replenish_interval)
+                    continue
+            for p in expired:
+                self._discard(p)
+            if wanted is None:
+                continue
+            try:
+                p = self._create(wanted)
+            except util.EchoNestException, e:
+                logger.debug("could not create playlist session for %s: %s" % (wanted, e))
+                with self._condition:
+                    self._condition.wait(self.replenish_interval)
+                continue
+            with self._condition:
+                if not self._closed and wanted in self._idle:
+                    self._idle[wanted].append((time.time(), p))
+                    p = None
+            if p is not None:
+                self._discard(p)
+
+    def close(self, delete=True):
+        """Stop replenishing and (by default) delete every idle session"""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, {}
+            retired, self._retired = self._retired, []
+            self._condition.notify_all()
+        if delete:
+            for sessions in idle.itervalues():
+                for created, p in sessions:
+                    self._discard(p)
+        for p in retired:
+            self._discard(p)
+
 class DeprecationHelper(object):
 
     def __init__(self, new_target):
@@ -5,7 +5,26 @@
 Copyright (c) 2010 The Echo Nest. All rights reserved.
 Created by Tyler Williams on 2010-04-25.
 """
+import threading
+import weakref
+
 import util
+import config
+
+class _SharedCache(dict):
+    """The cache of every live object with one id (see GenericProxy._share_cache), and their core attributes"""
+    __slots__ = ('core', '__weakref__')
+
+_identity_map = weakref.WeakValueDictionary()
+_identity_lock = threading.Lock()
+
+def _known_attributes(object_type, identifier):
+    # the core attributes of a live object with this id, so a new one needs no profile call
+    if not config.IDENTITY_MAP:
+        return {}
+    with _identity_lock:
+        shared = _identity_map.get((object_type, identifier))
+        return dict(shared.core) if shared is not None else {}
 
 class ResultList(list):
     def __init__(self, li, start=0, total=0):
@@ -19,10 +38,77 @@ class GenericProxy(object):
     def __init__(self):
         self.cache = {}
     
+    @classmethod
+    def _hydrate(cls, response_dict, core_attrs, copied_attrs=()):
+        """
+        Build an object straight from a decoded response dict that already has the core attributes.
+        The dict is copied once (in C) to become the cache; unicode keys are left alone since
+        they hash and compare equal to their str versions.
+        """
+        self = cls.__new__(cls)
+        cache = dict(response_dict)
+        self.id = cache.pop('id')
+        for attr in copied_attrs:
+            if attr in cache:
+                setattr(self, attr, cache[attr])
+        for attr in core_attrs:
+            setattr(self, attr, cache.pop(attr))
+        self.cache = cache
+        return self
+    
+    def _share_cache(self, core_attrs):
+        """
+        With config.IDENTITY_MAP on, make this object's cache the one all live objects with its id share,
+        merging in (over older values) what this object was built with. The shared cache is only weakly
+        held by the map, so it goes away with the last object using it.
+        """
+        if not config.IDENTITY_MAP or self.parsed_id is None:
+            return
+        key = (self._object_type, self.id)
+        with _identity_lock:
+            shared = _identity_map.get(key)
+            if shared is None:
+                shared = _identity_map[key] = _SharedCache()
+                shared.core = {}
+            shared.update(self.cache)
+            shared.core.update((ca, self.__dict__[ca]) for ca in core_attrs if ca in self.__dict__)
+        self.cache = shared
+    
     def get_attribute(self, method_name, **kwargs):
         result = util.callm("%s/%s" % (self._object_type, method_name), kwargs)
         return result['response']
     
+    @property
+    def parsed_id(self):
+        """self.id classified by util.parse_id (None for a name); worked out once per id value"""
+        parsed = self.__dict__.get('_parsed_id')
+        if parsed is None or parsed[0] != self.id:
+            parsed = self._parsed_id = (self.id, util.parse_id(self.id))
+        return parsed[1]
+    
+    @property
+    def result_cache(self):
+        # created on first use, so objects that never page or filter don't pay for it
+        if '_result_cache' not in self.__dict__:
+            self.__dict__.setdefault('_result_cache', util.TTLCache(config.RESULT_CACHE_SIZE, config.RESULT_CACHE_TTL))
+        return self._result_cache
+    
+    def get_cached_attribute(self, use_cache, method_name, **kwargs):
+        """
+        Like get_attribute, but answered from this object's result cache when the same method was called
+        with the same arguments recently. The fresh response is stored even when use_cache is False.
+        """
+        key = (method_name, util.normalize_params(kwargs))
+        endpoint = "%s/%s" % (self._object_type, method_name)
+        if use_cache:
+            response = self.result_cache.get(key)
+            util.metrics.count_cache(endpoint, response is not None)
+            if response is not None:
+                return response
+        response = self.get_attribute(method_name, **kwargs)
+        self.result_cache[key] = response
+        return response
+    
     def post_attribute(self, method_name, **kwargs):
         data = kwargs.pop('data') if 'data' in kwargs else {}
         result = util.callm("%s/%s" % (self._object_type, method_name), kwargs, POST=True, data=data)
@@ -39,14 +125,30 @@ class ArtistProxy(GenericProxy):
         # the following are integral to all artist objects... the rest is up to you!
         core_attrs = ['name']
         
+        if not all(ca in kwargs for ca in core_attrs):
+            kwargs = dict(_known_attributes(self._object_type, self.id), **kwargs)
         if not all(ca in kwargs for ca in core_attrs):
             profile = self.get_attribute('profile', **{'bucket':buckets})
             kwargs.update(profile.get('artist'))
         [self.__dict__.update({ca:kwargs.pop(ca)}) for ca in core_attrs+['id'] if ca in kwargs]        
         self.cache.update(kwargs)
+        self._share_cache(core_attrs)
+    
+    @classmethod
+    def from_response(cls, artist_dict):
+        """
+        Build an artist from a decoded API artist dict without the copies the constructor makes;
+        falls back to the constructor (and a profile call) if the dict has no name
+        """
+        if 'id' not in artist_dict or 'name' not in artist_dict:
+            return cls(**util.fix(artist_dict))
+        self = cls._hydrate(artist_dict, ('name',))
+        self._object_type = 'artist'
+        self._share_cache(('name',))
+        return self
     
     def get_attribute(self, *args, **kwargs):
-        if util.short_regex.match(self.id) or util.long_regex.match(self.id) or util.foreign_regex.match(self.id):
+        if self.parsed_id is not None:
             kwargs['id'] = self.id
         else:
             kwargs['name'] = self.id
@@ -63,7 +165,7 @@ class CatalogProxy(GenericProxy):
         # the following are integral to all catalog objects... the rest is up to you!
         core_attrs = ['name']
         if not all(ca in kwargs for ca in core_attrs):
-            if util.short_regex.match(self.id) or util.long_regex.match(self.id) or util.foreign_regex.match(self.id):
+            if self.parsed_id is not None:
                 profile = self.get_attribute('profile')
                 kwargs.update(profile['catalog'])
             else:
@@ -82,19 +184,31 @@ class CatalogProxy(GenericProxy):
         [self.__dict__.update({ca:kwargs.pop(ca)}) for ca in core_attrs+['id'] if ca in kwargs]
         self.cache.update(kwargs)
     
+    @classmethod
+    def from_response(cls, catalog_dict):
+        """
+        Build a catalog from a decoded API catalog dict without the copies the constructor makes;
+        falls back to the constructor (and a profile call) if the dict has no name
+        """
+        if 'id' not in catalog_dict or 'name' not in catalog_dict:
+            return cls(**util.fix(catalog_dict))
+        self = cls._hydrate(catalog_dict, ('name',))
+        self._object_type = 'catalog'
+        return self
+    
     def get_attribute_simple(self, *args, **kwargs):
         # omit name/id kwargs for this call
         return super(CatalogProxy, self).get_attribute(*args, **kwargs)
     
     def get_attribute(self, *args, **kwargs):
-        if util.short_regex.match(self.id) or util.long_regex.match(self.id) or util.foreign_regex.match(self.id):
+        if self.parsed_id is not None:
             kwargs['id'] = self.id
         else:
             kwargs['name'] = self.id
         return super(CatalogProxy, self).get_attribute(*args, **kwargs)
     
     def post_attribute(self, *args, **kwargs):
-        if util.short_regex.match(self.id) or util.long_regex.match(self.id) or util.foreign_regex.match(self.id):
+        if self.parsed_id is not None:
             kwargs['id'] = self.id
         else:
             kwargs['name'] = self.id
@@ -148,11 +262,28 @@ class SongProxy(GenericProxy):
         # the following are integral to all song objects... the rest is up to you!
         core_attrs = ['title', 'artist_name', 'artist_id']
         
+        if not all(ca in kwargs for ca in core_attrs):
+            kwargs = dict(_known_attributes(self._object_type, self.id), **kwargs)
         if not all(ca in kwargs for ca in core_attrs):
             profile = self.get_attribute('profile', **{'id':self.id, 'bucket':buckets})
             kwargs.update(profile.get('songs')[0])
         [self.__dict__.update({ca:kwargs.pop(ca)}) for ca in core_attrs]
         self.cache.update(kwargs)
+        self._share_cache(core_attrs)
+    
+    @classmethod
+    def from_response(cls, song_dict):
+        """
+        Build a song from a decoded API song dict without the copies the constructor makes;
+        falls back to the constructor (and a profile call) if the dict lacks title or artist
+        """
+        if not all(ca in song_dict for ca in ('id', 'title', 'artist_name', 'artist_id')):
+            return cls(**util.fix(song_dict))
+        self = cls._hydrate(song_dict, ('title', 'artist_name', 'artist_id'),
+                            ('track_id', 'tag', 'score', 'audio', 'release_image'))
+        self._object_type = 'song'
+        self._share_cache(('title', 'artist_name', 'artist_id'))
+        return self
     
     def get_attribute(self, *args, **kwargs):
         kwargs['id'] = self.id
@@ -8,10 +8,6 @@ Created by Tyler Williams on 2011-10-21.
 The Sandbox module loosely covers http://developer.echonest.com/docs/v4/sandbox.html
 Refer to the official api documentation if you are unsure about something.
 """
-try:
-    import json
-except ImportError:
-    import simplejson as json
 import datetime
 
 import util
@@ -8,14 +8,10 @@ Created by Tyler Williams on 2010-04-25.
 The Song module loosely covers http://developer.echonest.com/docs/v4/song.html
 Refer to the official api documentation if you are unsure about something.
 """
+import collections
 import os
 import util
 from proxies import SongProxy
-
-try:
-    import json
-except ImportError:
-    import simplejson as json
     
 class Song(SongProxy):
     """
@@ -356,6 +352,43 @@ class Song(SongProxy):
         return filter(lambda tr: tr['catalog']==util.map_idspace(catalog), self.cache['tracks'])
 
 
+class SongRecord(collections.namedtuple('SongRecord', 'id title artist_name artist_id extra')):
+    """
+    A compact, read-only song for bulk results: a tuple with no per-instance dict or cache.
+    extra holds the other response fields (audio_summary, song_hotttnesss, ...) as a dict, or None.
+    
+    Use to_song() to get a full Song object when you need one.
+    
+    >>> recs = song.profile(song_ids, buckets=['audio_summary'], records=True)
+    >>> recs[0].title, recs[0].get('audio_summary')['tempo']
+    (u"Say It Ain't So", 76.05)
+    >>> recs[0].to_song()
+    <song - Say It Ain't So>
+    """
+    __slots__ = ()
+    
+    @classmethod
+    def from_response(cls, song_dict, fields=None):
+        """Build a record from a decoded API song dict; fields limits which extra fields are kept"""
+        if fields is None:
+            extra = dict(song_dict)
+            for attr in cls._fields[:-1]:
+                extra.pop(attr, None)
+        else:
+            extra = dict((f, song_dict[f]) for f in fields if f in song_dict)
+        return cls(song_dict['id'], song_dict.get('title'), song_dict.get('artist_name'),
+                   song_dict.get('artist_id'), extra or None)
+    
+    def get(self, field, default=None):
+        """Look up one of the extra response fields"""
+        return self.extra.get(field, default) if self.extra else default
+    
+    def to_song(self):
+        """A full Song object with the same data"""
+        song_dict = dict(self.extra or ())
+        song_dict.update(id=self.id, title=self.title, artist_name=self.artist_name, artist_id=self.artist_id)
+        return Song.from_response(song_dict)
+
 def search(title=None, artist=None, artist_id=None, combined=None, description=None, style=None, mood=None,
            results=None, start=None, max_tempo=None, min_tempo=None,
            max_duration=None, min_duration=None, max_loudness=None, min_loudness=None,
@@ -368,7 +401,7 @@ def search(title=None, artist=None, artist_id=None, combined=None, description=N
            artist_end_year_before=None,song_type=None,min_song_currency=None,max_song_currency=None,
            min_song_discovery=None, max_song_discovery=None, max_acousticness=None, min_acousticness=None,
            max_liveness=None, min_liveness=None, max_speechiness=None, min_speechiness=None,
-           max_valence=None, min_valence=None):
+           max_valence=None, min_valence=None, records=False):
     """Search for songs by name, description, or constraint.
 
     Args:
@@ -422,6 +455,9 @@ def search(title=None, artist=None, artist_id=None, combined=None, description=N
         artist_end_year_after (int): Returned songs's artists will have stopped recording music after this year.
         song_type (string): A string or list of strings specifiying the type of song to search for.
 
+        records (bool or list): Return compact SongRecords instead of Song objects; a list of field
+        names (e.g. ['audio_summary']) keeps only those extra fields in each record
+
     Returns:
         A list of Song objects
 
@@ -443,11 +479,17 @@ def search(title=None, artist=None, artist_id=None, combined=None, description=N
     kwargs = locals()
     kwargs['bucket'] = buckets
     del kwargs['buckets']
+    del kwargs['records']
     
     result = util.callm("%s/%s" % ('song', 'search'), kwargs)
-    return [Song(**util.fix(s_dict)) for s_dict in result['response']['songs']]
-
-def profile(ids=None, track_ids=None, buckets=None, limit=False):
+    if records is False:
+        build = Song.from_response
+    else:
+        fields = None if records is True else records
+        build = lambda s_dict: SongRecord.from_response(s_dict, fields)
+    return [build(s_dict) for s_dict in result['response']['songs']]
+
+def profile(ids=None, track_ids=None, buckets=None, limit=False, records=False):
     """get the profiles for multiple songs at once
         
     Args:
@@ -457,6 +499,9 @@ def profile(ids=None, track_ids=None, buckets=None, limit=False):
         buckets (list): A list of strings specifying which buckets to retrieve
 
         limit (bool): A boolean indicating whether or not to limit the results to one of the id spaces specified in buckets
+
+        records (bool or list): Return compact SongRecords instead of Song objects; a list of field
+        names (e.g. ['audio_summary']) keeps only those extra fields in each record
     
     Returns:
         A list of term document dicts
@@ -504,5 +549,10 @@ def profile(ids=None, track_ids=None, buckets=None, limit=False):
         kwargs['limit'] = 'true'
     
     result = util.callm("%s/%s" % ('song', 'profile'), kwargs)
-    return [Song(**util.fix(s_dict)) for s_dict in result['response']['songs']]
+    if records is False:
+        build = Song.from_response
+    else:
+        fields = None if records is True else records
+        build = lambda s_dict: SongRecord.from_response(s_dict, fields)
+    return [build(s_dict) for s_dict in result['response']['songs']]
 
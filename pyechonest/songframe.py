@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Copyright (c) 2010 The Echo Nest. All rights reserved.
+
+The SongFrame module holds large sets of songs column by column, so audio_summary analytics
+run over typed arrays instead of one dict lookup per song and field.
+"""
+import array
+import itertools
+import math
+import struct
+import sys
+
+import util
+from song import SongRecord
+
+FLOAT_FIELDS = ('tempo', 'duration', 'loudness', 'danceability', 'energy', 'acousticness', 'liveness',
+                'speechiness', 'valence', 'song_hotttnesss', 'artist_familiarity', 'artist_hotttnesss')
+"Numeric fields, stored as doubles; missing values are NaN"
+
+INT_FIELDS = ('key', 'mode', 'time_signature')
+"Small integer fields, stored as signed bytes; missing values are -1"
+
+TEXT_FIELDS = ('id', 'title', 'artist_id', 'artist_name')
+
+# song dict fields that live at the top level rather than in audio_summary
+_TOP_LEVEL_FIELDS = ('song_hotttnesss', 'artist_familiarity', 'artist_hotttnesss')
+
+_MAGIC = 'ENSF'
+_VERSION = 1
+_HEADER = struct.Struct('<4sBI')
+_NAN = float('nan')
+
+def _isnan(x):
+    return x != x
+
+class SongFrame(object):
+    """
+    A column store for songs: ids, titles and artists as lists, and every audio_summary field
+    (plus hotttnesss and familiarity) as a typed array.array.
+
+    Iterating a frame, or indexing it, gives SongRecords.
+
+    Example:
+
+    >>> f = songframe.SongFrame.from_profile(song_ids)
+    >>> fast = f.where(min_tempo=140, max_loudness=-6).sort('energy', reverse=True)
+    >>> len(fast), fast.mean('danceability')
+    (412, 0.5816)
+    >>> f.save('songs.frame')
+    >>> f = songframe.SongFrame.load('songs.frame')
+    """
+
+    def __init__(self, columns=None):
+        columns = columns or {}
+        self.columns = {}
+        for name in TEXT_FIELDS:
+            self.columns[name] = columns.get(name, [])
+        for name in FLOAT_FIELDS:
+            self.columns[name] = columns.get(name, array.array('d'))
+        for name in INT_FIELDS:
+            self.columns[name] = columns.get(name, array.array('b'))
+
+    @classmethod
+    def from_response(cls, song_dicts):
+        """Build a frame from decoded API song dicts, e.g. result['response']['songs']"""
+        frame = cls()
+        frame.extend(song_dicts)
+        return frame
+
+    @classmethod
+    def from_profile(cls, ids, buckets=('audio_summary', 'song_hotttnesss', 'artist_familiarity', 'artist_hotttnesss'),
+                     chunk_size=100):
+        """Build a frame from song/profile calls for a list of song IDs, chunk_size IDs per call"""
+        frame = cls()
+        for i in xrange(0, len(ids), chunk_size):
+            result = util.callm("%s/%s" % ('song', 'profile'), {'id': ids[i:i + chunk_size], 'bucket': list(buckets)})
+            frame.extend(result['response']['songs'])
+        return frame
+
+    @classmethod
+    def from_search(cls, buckets=('audio_summary', 'song_hotttnesss', 'artist_familiarity', 'artist_hotttnesss'),
+                    **kwargs):
+        """Build a frame from a song/search call; kwargs are song/search parameters (min_tempo=..., results=...)"""
+        kwargs['bucket'] = list(buckets)
+        result = util.callm("%s/%s" % ('song', 'search'), kwargs)
+        return cls.from_response(result['response']['songs'])
+
+    def extend(self, song_dicts):
+        """Append decoded API song dicts (or Song objects, or SongRecords) to the frame"""
+        columns = self.columns
+        for d in song_dicts:
+            if isinstance(d, SongRecord):
+                top = dict(d.extra or {}, id=d.id, title=d.title, artist_id=d.artist_id, artist_name=d.artist_name)
+            elif hasattr(d, 'cache'):
+                top = dict(d.cache, id=d.id, title=d.title, artist_id=d.artist_id, artist_name=d.artist_name)
+            else:
+                top = d
+            summary = top.get('audio_summary') or {}
+            for name in TEXT_FIELDS:
+                columns[name].append(top.get(name))
+            for name in FLOAT_FIELDS:
+                value = top.get(name) if name in _TOP_LEVEL_FIELDS else summary.get(name)
+                columns[name].append(_NAN if value is None else value)
+            for name in INT_FIELDS:
+                value = summary.get(name)
+                columns[name].append(-1 if value is None else value)
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def __repr__(self):
+        return "<SongFrame - %d songs>" % len(self)
+
+    def column(self, name):
+        """The column for a field: a list for text fields, an array.array otherwise
+        (wrap numeric columns with numpy.frombuffer for a zero-copy numpy view)"""
+        return self.columns[name]
+
+    def __getitem__(self, i):
+        columns = self.columns
+        summary = {}
+        extra = {}
+        for name in FLOAT_FIELDS:
+            value = columns[name][i]
+            if not _isnan(value):
+                (extra if name in _TOP_LEVEL_FIELDS else summary)[name] = value
+        for name in INT_FIELDS:
+            value = columns[name][i]
+            if value != -1:
+                summary[name] = value
+        if summary:
+            extra['audio_summary'] = summary
+        return SongRecord(columns['id'][i], columns['title'][i], columns['artist_name'][i],
+                          columns['artist_id'][i], extra or None)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def take(self, indices):
+        """A new frame holding the given rows, in the given order"""
+        indices = list(indices)
+        columns = {}
+        for name, col in self.columns.iteritems():
+            picked = map(col.__getitem__, indices)
+            columns[name] = array.array(col.typecode, picked) if isinstance(col, array.array) else picked
+        return SongFrame(columns)
+
+    def where(self, **conditions):
+        """
+        A new frame with the rows that match every condition. Conditions are min_<field>=value and
+        max_<field>=value for numeric fields, or <field>=value (or a list of values) for equality.
+        Rows where a numeric field is missing never match a condition on it.
+
+        >>> f.where(min_tempo=120, max_tempo=130, mode=1, artist_id=['ARH6W4X1187B99274F'])
+        """
+        keep = None
+        for condition, value in conditions.iteritems():
+            if condition.startswith('min_') and condition[4:] in self.columns:
+                name, test = condition[4:], lambda x, v=value: x >= v
+            elif condition.startswith('max_') and condition[4:] in self.columns:
+                name, test = condition[4:], lambda x, v=value: x <= v
+            elif condition in self.columns:
+                name = condition
+                test = set(value).__contains__ if isinstance(value, (list, tuple, set)) else (lambda x, v=value: x == v)
+            else:
+                raise ValueError("Unknown SongFrame condition: %s" % condition)
+            col = self.columns[name]
+            if name in INT_FIELDS:
+                matches = [x != -1 and test(x) for x in col]
+            else:
+                matches = [test(x) for x in col]
+            keep = matches if keep is None else map(bool.__and__, keep, matches)
+        if keep is None:
+            return self.take(xrange(len(self)))
+        return self.take(itertools.compress(xrange(len(self)), keep))
+
+    def sort(self, field, reverse=False):
+        """A new frame sorted on a field; rows with the field missing go last"""
+        col = self.columns[field]
+        if field in INT_FIELDS:
+            missing = lambda x: x == -1
+        else:
+            missing = lambda x: x is None or (isinstance(x, float) and _isnan(x))
+        present = [i for i in xrange(len(col)) if not missing(col[i])]
+        present.sort(key=col.__getitem__, reverse=reverse)
+        return self.take(present + [i for i in xrange(len(col)) if missing(col[i])])
+
+    def _present(self, field):
+        col = self.columns[field]
+        if field in INT_FIELDS:
+            return [x for x in col if x != -1]
+        return [x for x in col if not _isnan(x)]
+
+    def count(self, field):
+        """The number of rows where a numeric field is present"""
+        return len(self._present(field))
+
+    def sum(self, field):
+        return math.fsum(self._present(field))
+
+    def mean(self, field):
+        """The mean of a numeric field over the rows where it is present (None if it is never present)"""
+        values = self._present(field)
+        return math.fsum(values) / len(values) if values else None
+
+    def min(self, field):
+        values = self._present(field)
+        return min(values) if values else None
+
+    def max(self, field):
+        values = self._present(field)
+        return max(values) if values else None
+
+    def group_mean(self, field, by='artist_id'):
+        """A dict mapping each value of the by column to the mean of field over its rows"""
+        sums, counts = {}, {}
+        for key, value in itertools.izip(self.columns[by], self.columns[field]):
+            if (field in INT_FIELDS and value == -1) or (field not in INT_FIELDS and _isnan(value)):
+                continue
+            sums[key] = sums.get(key, 0.0) + value
+            counts[key] = counts.get(key, 0) + 1
+        return dict((key, sums[key] / counts[key]) for key in sums)
+
+    def save(self, filename):
+        """Write the frame to a compact binary file"""
+        f = open(filename, 'wb')
+        try:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, len(self)))
+            for name in TEXT_FIELDS:
+                text = u'\0'.join(v or u'' for v in self.columns[name]).encode('utf-8')
+                f.write(struct.pack('<I', len(text)))
+                f.write(text)
+            for name in FLOAT_FIELDS + INT_FIELDS:
+                col = self.columns[name]
+                if sys.byteorder != 'little':
+                    col = array.array(col.typecode, col)
+                    col.byteswap()
+                col.tofile(f)
+        finally:
+            f.close()
+
+    @classmethod
+    def load(cls, filename):
+        """Read a frame written by save"""
+        f = open(filename, 'rb')
+        try:
+            magic, version, rows = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError("%s is not a SongFrame file" % filename)
+            columns = {}
+            for name in TEXT_FIELDS:
+                size, = struct.unpack('<I', f.read(4))
+                values = f.read(size).decode('utf-8').split(u'\0') if rows else []
+                columns[name] = [v or None for v in values]
+            for name in FLOAT_FIELDS:
+                columns[name] = array.array('d')
+                columns[name].fromfile(f, rows)
+            for name in INT_FIELDS:
+                columns[name] = array.array('b')
+                columns[name].fromfile(f, rows)
+            if sys.byteorder != 'little':
+                for name in FLOAT_FIELDS:
+                    columns[name].byteswap()
+        finally:
+            f.close()
+        return cls(columns)
@@ -1,9 +1,4 @@
 import urllib2
-try:
-    import json
-except ImportError:
-    import simplejson as json
-
 import hashlib
 from proxies import TrackProxy
 import util
@@ -122,18 +117,18 @@ class Track(TrackProxy):
                 # Try the existing analysis_url first. This expires shortly
                 # after creation.
                 try:
-                    json_string = urllib2.urlopen(self.analysis_url).read()
+                    analysis = util.download(self.analysis_url, decode=util.json_loads)
                 except urllib2.HTTPError:
                     # Probably the analysis_url link has expired. Refresh it.
+                    util.metrics.count_retry('track/analysis')
                     param_dict = dict(id = self.id)
                     new_track = _profile(param_dict, DEFAULT_ASYNC_TIMEOUT)
                     if new_track and new_track.analysis_url:
                         self.analysis_url = new_track.analysis_url
-                        json_string = urllib2.urlopen(self.analysis_url).read()
+                        analysis = util.download(self.analysis_url, decode=util.json_loads)
                     else:
                         raise Exception("Failed to create track analysis.")
 
-                analysis = json.loads(json_string)
                 analysis_track = analysis.pop('track', {})
                 self.__dict__.update(analysis)
                 self.__dict__.update(analysis_track)
@@ -155,6 +150,7 @@ def _wait_for_pending_track(trid, timeout):
     timeout_counter = 3
     while status == 'pending' and time.time() < end_time:
         time.sleep(timeout_counter)
+        util.metrics.count_retry('track/profile')
         result = util.callm('track/profile', param_dict)
         status = result['response']['track']['status'].lower()
         # Slowly increment to wait longer each time.
@@ -7,24 +7,22 @@ Created by Tyler Williams on 2010-04-25.
 
 Utility functions to support the Echo Nest web API interface.
 """
+import httplib
 import urllib
 import urllib2
-import httplib
+import bisect
+import collections
+import contextlib
 import config
 import logging
-import socket
 import re
 import time
-import os
-import subprocess
+import sys
+import threading
 import traceback
+import zlib
 from types import StringType, UnicodeType
 
-try:
-    import json
-except ImportError:
-    import simplejson as json
-
 logger = logging.getLogger(__name__)
 TYPENAMES = (
     ('AR', 'artist'),
@@ -41,8 +39,54 @@ TYPENAMES = (
 foreign_regex = re.compile(r'^.+?:(%s):([^^]+)\^?([0-9\.]+)?' % r'|'.join(n[1] for n in TYPENAMES))
 short_regex = re.compile(r'^((%s)[0-9A-Z]{16})\^?([0-9\.]+)?' % r'|'.join(n[0] for n in TYPENAMES))
 long_regex = re.compile(r'music://id.echonest.com/.+?/(%s)/(%s)[0-9A-Z]{16}\^?([0-9\.]+)?' % (r'|'.join(n[0] for n in TYPENAMES), r'|'.join(n[0] for n in TYPENAMES)))
+id_regex = re.compile(r'^(?:(?P<short>(?P<short_type>%(codes)s)[0-9A-Z]{16})'
+                      r'|music://id.echonest.com/.+?/(?:%(codes)s)/(?P<long>(?P<long_type>%(codes)s)[0-9A-Z]{16})'
+                      r'|(?P<foreign>.+?:(?P<foreign_type>%(names)s):[^^]+))\^?(?P<weight>[0-9\.]+)?'
+                      % {'codes': r'|'.join(n[0] for n in TYPENAMES), 'names': r'|'.join(n[1] for n in TYPENAMES)})
+TYPECODES = dict((name, code) for (code, name) in TYPENAMES)
+
+EchoNestID = collections.namedtuple('EchoNestID', 'kind type id weight')
+"""
+A parsed identifier: kind is 'short', 'long' or 'foreign', type is the two letter type code ('AR', 'SO', ...),
+id is the identifier without any weight suffix and weight is the '^weight' suffix as a float (or None).
+"""
 headers = [('User-Agent', 'Pyechonest %s' % (config.__version__,))]
 
+def _id_from_match(m):
+    weight = m.group('weight')
+    if weight is not None:
+        try:
+            weight = float(weight)
+        except ValueError:
+            weight = None
+    if m.group('short'):
+        return EchoNestID('short', m.group('short_type'), m.group('short'), weight)
+    elif m.group('long'):
+        return EchoNestID('long', m.group('long_type'), m.group('long'), weight)
+    else:
+        return EchoNestID('foreign', TYPECODES[m.group('foreign_type')], m.group('foreign'), weight)
+
+def parse_id(identifier):
+    """
+    Classify an identifier in one pass: returns an EchoNestID for Echo Nest IDs (short or long form)
+    and foreign IDs, or None for anything else (i.e. a name).
+    
+    >>> util.parse_id('ARH6W4X1187B99274F^2.5')
+    EchoNestID(kind='short', type='AR', id='ARH6W4X1187B99274F', weight=2.5)
+    >>> util.parse_id('musicbrainz:artist:a74b1b7f-71a5-4011-9441-d0b5e4122711')
+    EchoNestID(kind='foreign', type='AR', id='musicbrainz:artist:a74b1b7f-71a5-4011-9441-d0b5e4122711', weight=None)
+    >>> util.parse_id('the national')
+    >>>
+    """
+    m = id_regex.match(identifier)
+    return _id_from_match(m) if m else None
+
+def classify_ids(identifiers):
+    """
+    parse_id over a list of identifiers, returning a list of EchoNestIDs (None for names) in the same order
+    """
+    return [_id_from_match(m) if m else None for m in map(id_regex.match, identifiers)]
+
 class MyBaseHandler(urllib2.BaseHandler):
     def default_open(self, request):
         if config.TRACE_API_CALLS:
@@ -55,14 +99,39 @@ class MyErrorProcessor(urllib2.HTTPErrorProcessor):
         code = response.code
         if config.TRACE_API_CALLS:
             logger.info("took %2.2fs: (%i)" % (time.time()-request.start_time,code))
-        if code/100 in (2, 4, 5):
+        if code/100 in (2, 4, 5) or code == 304:
             return response
         else:
-            urllib2.HTTPErrorProcessor.http_response(self, request, response)
+            return urllib2.HTTPErrorProcessor.http_response(self, request, response)
 
 opener = urllib2.build_opener(MyBaseHandler(), MyErrorProcessor())
 opener.addheaders = headers
 
+class HTTPTransport(object):
+    """
+    Sends requests over HTTP with the module opener. This is the default transport; a transport is
+    anything with an open(url, data=None, headers=None) method that returns a file-like response
+    with read(), getcode() and headers (see set_transport and the cassette module). Requests made
+    inside a request_timeout block use that socket timeout.
+    """
+    def open(self, url, data=None, headers=None):
+        request = urllib2.Request(url, data, dict(headers or {}))
+        timeout = getattr(_call_context, 'timeout', None)
+        if timeout is None:
+            return opener.open(request)
+        return opener.open(request, timeout=timeout)
+
+transport = HTTPTransport()
+
+def set_transport(new_transport):
+    """
+    Send every API call, and every analysis download, through new_transport (None restores plain HTTP).
+    Returns the transport that was in use.
+    """
+    global transport
+    previous, transport = transport, new_transport or HTTPTransport()
+    return previous
+
 class EchoNestException(Exception):
     """
     Parent exception class.  Catches API and URL/HTTP errors.
@@ -102,18 +171,475 @@ class EchoNestIOError(EchoNestException):
         formatted_message = ('Echo Nest IOError: %s' % headers,)
         super(EchoNestIOError, self).__init__(code, formatted_message, headers)
 
-def get_successful_response(raw_json):
-    if hasattr(raw_json, 'headers'):
-        headers = raw_json.headers
+class QuotaExceeded(EchoNestException):
+    """
+    A call refused locally because it would go over a hard budget (see QuotaLedger.set_budget).
+    Like the API's own rate limit error, its code is 3.
+    """
+    def __init__(self, message):
+        super(QuotaExceeded, self).__init__(3, message, None)
+
+def encode_params(param_dict):
+    """
+    Flatten a param dict (or a sequence of (key, value) pairs) into a list of (key, value) pairs ready
+    for urlencode: list values become repeated keys, None values are dropped and unicode is utf-8 encoded.
+    """
+    param_list = []
+    items = param_dict.iteritems() if hasattr(param_dict, 'iteritems') else param_dict
+    for key,val in items:
+        if isinstance(val, (list, tuple)):
+            param_list.extend( [(key,subval) for subval in val] )
+        elif val is not None:
+            if isinstance(val, unicode):
+                val = val.encode('utf-8')
+            param_list.append( (key,val) )
+    return param_list
+
+def normalize_params(param_dict):
+    """
+    A hashable, order-independent form of a param dict or sequence of pairs, for use as a cache key
+    """
+    return tuple(sorted(encode_params(param_dict)))
+
+class TTLCache(object):
+    """
+    A thread-safe mapping that holds at most maxsize entries, evicting the least recently used,
+    and forgets entries ttl seconds after they were set (ttl=None keeps them until evicted).
+    """
+    _missing = object()
+
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            expires, value = self._data.get(key, (None, self._missing))
+            if value is self._missing or (expires is not None and expires < time.time()):
+                return default
+            # expired entries stay (until evicted) for get_stale; fresh ones move to the recent end
+            del self._data[key]
+            self._data[key] = (expires, value)
+            return value
+
+    def get_stale(self, key, default=None):
+        """
+        The value for key even after it has expired, as long as it has not been evicted, and the
+        seconds since it expired (negative while it is fresh). Returns (default, None) for a missing key.
+        """
+        with self._lock:
+            expires, value = self._data.get(key, (None, self._missing))
+            if value is self._missing:
+                return default, None
+            del self._data[key]
+            self._data[key] = (expires, value)
+            return value, (time.time() - expires if expires is not None else float('-inf'))
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.time() + ttl if ttl is not None else None, value)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    __setitem__ = set
+
+    def __contains__(self, key):
+        return self.get(key, self._missing) is not self._missing
+
+    def __len__(self):
+        return len(self._data)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            expires, value = self._data.pop(key, (None, default))
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+class MetricsRegistry(object):
+    """
+    Per-endpoint call counters and latency histograms for everything sent through callm, oauthgetm
+    and analysis downloads ('track/analysis'), plus the retry and result-cache counts callers report.
+
+    >>> util.metrics.snapshot()['artist/profile']
+    {'calls': 3, 'errors': {'5': 1}, 'bytes_in': 1822, 'bytes_out': 312, 'retries': 0,
+     'cache_hits': 2, 'cache_misses': 3, 'latency': {'count': 3, 'sum': 0.41, 'buckets': [(0.005, 0), ...]}}
+    >>> print util.metrics.exposition()
+    pyechonest_calls_total{endpoint="artist/profile"} 3
+    ...
+    """
+    LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def _endpoint(self, endpoint):
+        stats = self._endpoints.get(endpoint)
+        if stats is None:
+            stats = self._endpoints[endpoint] = {
+                'calls': 0, 'errors': collections.Counter(), 'bytes_in': 0, 'bytes_out': 0, 'retries': 0,
+                'cache_hits': 0, 'cache_misses': 0, 'latency_sum': 0.0,
+                'latency_counts': [0] * (len(self.buckets) + 1),
+            }
+        return stats
+
+    def observe_call(self, endpoint, seconds, bytes_out=0, bytes_in=0, error=None):
+        """Count one call; error is the API error code, 'io' for a network error, or else the exception's class name"""
+        if not config.COLLECT_METRICS:
+            return
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            stats['calls'] += 1
+            stats['bytes_out'] += bytes_out
+            stats['bytes_in'] += bytes_in
+            stats['latency_sum'] += seconds
+            stats['latency_counts'][bisect.bisect_left(self.buckets, seconds)] += 1
+            if error is not None:
+                stats['errors'][str(error)] += 1
+
+    def count_retry(self, endpoint):
+        if config.COLLECT_METRICS:
+            with self._lock:
+                self._endpoint(endpoint)['retries'] += 1
+
+    def count_cache(self, endpoint, hit):
+        if config.COLLECT_METRICS:
+            with self._lock:
+                self._endpoint(endpoint)['cache_hits' if hit else 'cache_misses'] += 1
+
+    def snapshot(self):
+        """A dict mapping each endpoint to a plain dict of its counters; latency buckets are cumulative"""
+        out = {}
+        with self._lock:
+            for endpoint, stats in self._endpoints.iteritems():
+                cumulative, buckets = 0, []
+                for bound, count in zip(self.buckets + (float('inf'),), stats['latency_counts']):
+                    cumulative += count
+                    buckets.append((bound, cumulative))
+                out[endpoint] = {
+                    'calls': stats['calls'], 'errors': dict(stats['errors']), 'bytes_in': stats['bytes_in'],
+                    'bytes_out': stats['bytes_out'], 'retries': stats['retries'], 'cache_hits': stats['cache_hits'],
+                    'cache_misses': stats['cache_misses'],
+                    'latency': {'count': cumulative, 'sum': stats['latency_sum'], 'buckets': buckets},
+                }
+        return out
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+    def exposition(self):
+        """The snapshot in the Prometheus plain-text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+        def family(name, kind, help_text):
+            lines.append('# HELP pyechonest_%s %s' % (name, help_text))
+            lines.append('# TYPE pyechonest_%s %s' % (name, kind))
+        for name, field, help_text in (('calls_total', 'calls', 'API calls made'),
+                                       ('bytes_in_total', 'bytes_in', 'Response bytes received'),
+                                       ('bytes_out_total', 'bytes_out', 'Request bytes sent'),
+                                       ('retries_total', 'retries', 'Calls repeated by pyechonest'),
+                                       ('cache_hits_total', 'cache_hits', 'Results answered from a local cache'),
+                                       ('cache_misses_total', 'cache_misses', 'Results not found in a local cache')):
+            family(name, 'counter', help_text)
+            for endpoint in sorted(snapshot):
+                lines.append('pyechonest_%s{endpoint="%s"} %d' % (name, endpoint, snapshot[endpoint][field]))
+        family('errors_total', 'counter', 'Failed calls by API error code')
+        for endpoint in sorted(snapshot):
+            for code, count in sorted(snapshot[endpoint]['errors'].iteritems()):
+                lines.append('pyechonest_errors_total{endpoint="%s",code="%s"} %d' % (endpoint, code, count))
+        family('call_seconds', 'histogram', 'API call latency')
+        for endpoint in sorted(snapshot):
+            latency = snapshot[endpoint]['latency']
+            for bound, count in latency['buckets']:
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('pyechonest_call_seconds_bucket{endpoint="%s",le="%s"} %d' % (endpoint, le, count))
+            lines.append('pyechonest_call_seconds_sum{endpoint="%s"} %r' % (endpoint, latency['sum']))
+            lines.append('pyechonest_call_seconds_count{endpoint="%s"} %d' % (endpoint, latency['count']))
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
+
+_call_context = threading.local()
+
+@contextlib.contextmanager
+def caller(tag, batch=False):
+    """
+    Charge the API calls made in this thread inside the with block to a caller tag in util.quota.
+    Batch callers yield to interactive ones: while any interactive calls were made in the last
+    quota window, batch calls are held to config.QUOTA_BATCH_SHARE of each budget.
+
+    >>> with util.caller('nightly-import', batch=True):
+    ...     songs = song.profile(ids)
+    """
+    previous = getattr(_call_context, 'caller', None)
+    _call_context.caller = (tag, batch)
+    try:
+        yield
+    finally:
+        _call_context.caller = previous
+
+@contextlib.contextmanager
+def request_timeout(seconds):
+    """
+    Give the HTTP requests made in this thread inside the with block a socket timeout of seconds,
+    without changing the process-wide default that other threads (and clients) rely on.
+
+    >>> with util.request_timeout(5):
+    ...     a = artist.Artist('radiohead')
+    """
+    previous = getattr(_call_context, 'timeout', None)
+    _call_context.timeout = seconds
+    try:
+        yield
+    finally:
+        _call_context.timeout = previous
+
+def start_thread(target, name=None):
+    """
+    Run target() in a new daemon thread whose API calls go through the client entered in the thread
+    starting it (see client.Client), charged to the same caller tag (see caller). Returns the started thread.
+    """
+    import client
+    context = getattr(_call_context, 'caller', None)
+    entered = client._stack()
+    current = entered[-1] if entered else None
+    def run():
+        _call_context.caller = context
+        if current is None:
+            target()
+        else:
+            with current:
+                target()
+    thread = threading.Thread(target=run, name=name)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+def _key_label(api_key):
+    # enough of a key to tell shared keys apart without putting the key itself in reports
+    return '...' + api_key[-4:] if api_key else 'none'
+
+class QuotaLedger(object):
+    """
+    Counts API calls and their estimated cost (config.QUOTA_COSTS) per API key and caller tag
+    (see caller), and enforces budgets over a sliding window of window seconds.
+
+    >>> util.quota.set_budget(soft=100, hard=120)                 # per key, all callers together
+    >>> util.quota.set_budget(soft=20, caller='nightly-import')  # one caller
+    >>> util.quota.usage()
+    [{'key': '...X9QF', 'caller': 'nightly-import', 'calls': 412, 'cost': 412.0, 'window_cost': 20.0}, ...]
+    """
+    def __init__(self, window=60.0):
+        self.window = window
+        self._lock = threading.Condition(threading.Lock())
+        self._budgets = {}
+        self._totals = {}
+        self._recent = collections.deque()
+
+    def set_budget(self, soft=None, hard=None, api_key=None, caller=None):
+        """
+        Budget the cost of calls per window for one API key and/or caller tag (None matches any).
+        Calls over a soft budget wait until the window has room; calls over a hard budget raise
+        QuotaExceeded. Setting both to None removes the budget.
+        """
+        key = (_key_label(api_key) if api_key else None, caller)
+        with self._lock:
+            if soft is None and hard is None:
+                self._budgets.pop(key, None)
+            else:
+                self._budgets[key] = (soft, hard)
+            self._lock.notify_all()
+
+    def _expire(self, now):
+        while self._recent and self._recent[0][0] <= now - self.window:
+            self._recent.popleft()
+
+    def _delay(self, label, tag, batch, cost, now):
+        # seconds until the call fits every matching budget; raises if it never will
+        interactive = batch and any(not b for (t, k, c, b, x) in self._recent)
+        delay = 0.0
+        for (budget_key, budget_caller), (soft, hard) in self._budgets.iteritems():
+            if budget_key not in (None, label) or budget_caller not in (None, tag):
+                continue
+            matching = [(t, x) for (t, k, c, b, x) in self._recent
+                        if budget_key in (None, k) and budget_caller in (None, c)]
+            spent = sum(x for (t, x) in matching)
+            if hard is not None and spent + cost > hard:
+                raise QuotaExceeded("Hard budget of %s per %ss exceeded for key %s, caller %s" %
+                                    (hard, self.window, budget_key or 'any', budget_caller or 'any'))
+            limit = soft if soft is not None else hard
+            if interactive:
+                limit *= config.QUOTA_BATCH_SHARE
+            if spent + cost > limit and matching:
+                # wait for enough of the oldest calls to leave the window
+                for (t, x) in matching:
+                    spent -= x
+                    if spent + cost <= limit:
+                        break
+                delay = max(delay, t + self.window - now)
+        return delay
+
+    def charge(self, method, api_key):
+        """Account for one call, first waiting for (or refusing it over) any budget it would exceed"""
+        tag, batch = getattr(_call_context, 'caller', None) or (None, False)
+        label = _key_label(api_key)
+        cost = float(config.QUOTA_COSTS.get(method, 1))
+        with self._lock:
+            while True:
+                now = time.time()
+                self._expire(now)
+                delay = self._delay(label, tag, batch, cost, now) if self._budgets else 0
+                if delay <= 0:
+                    break
+                self._lock.wait(delay)
+            self._recent.append((now, label, tag, batch, cost))
+            totals = self._totals.get((label, tag))
+            if totals is None:
+                totals = self._totals[(label, tag)] = {'calls': 0, 'cost': 0.0}
+            totals['calls'] += 1
+            totals['cost'] += cost
+
+    def window_cost(self, api_key):
+        """The cost of the calls made with api_key in the current window"""
+        label = _key_label(api_key)
+        with self._lock:
+            self._expire(time.time())
+            return sum(cost for (t, k, c, b, cost) in self._recent if k == label)
+
+    def usage(self):
+        """A list of dicts of calls and cost per key and caller, in total and in the current window"""
+        with self._lock:
+            self._expire(time.time())
+            window = collections.Counter()
+            for (t, label, tag, batch, cost) in self._recent:
+                window[(label, tag)] += cost
+            return [{'key': label, 'caller': tag, 'calls': totals['calls'], 'cost': totals['cost'],
+                     'window_cost': window[(label, tag)]}
+                    for ((label, tag), totals) in sorted(self._totals.iteritems())]
+
+    def exposition(self):
+        """usage() in the same plain-text exposition format as MetricsRegistry.exposition"""
+        usage = self.usage()
+        lines = []
+        for name, field, fmt in (('quota_calls_total', 'calls', '%d'), ('quota_cost_total', 'cost', '%r')):
+            lines.append('# TYPE pyechonest_%s counter' % name)
+            for u in usage:
+                labels = 'key="%s",caller="%s"' % (u['key'], u['caller'] or '')
+                lines.append(('pyechonest_%s{%s} ' + fmt) % (name, labels, u[field]))
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._totals.clear()
+            self._recent.clear()
+
+quota = QuotaLedger()
+
+JSON_BACKENDS = ('ujson', 'simplejson', 'json')
+"""
+JSON libraries that can decode API responses, in the order they are picked: ujson (not with str_keys),
+simplejson (only with its C speedups) and json
+"""
+
+_json_decoder = {'name': None, 'loads': None}
+
+def _str_key_dict(pairs):
+    return dict((str(k), v) for (k, v) in pairs)
+
+def _json_loads_for(name, str_keys, auto=False):
+    if name == 'ujson':
+        if str_keys:
+            raise ValueError("ujson cannot decode object keys to str; use simplejson or json with str_keys")
+        import ujson
+        return ujson.loads
+    if name == 'simplejson':
+        import simplejson
+        if auto:
+            # without its C speedups simplejson is much slower than the stdlib json scanner
+            import simplejson._speedups
+        # given a str, simplejson returns ascii strings as str; decode first so values are unicode as with json
+        if str_keys:
+            return lambda s: simplejson.loads(s.decode('utf-8') if isinstance(s, str) else s,
+                                              object_pairs_hook=_str_key_dict)
+        return lambda s: simplejson.loads(s.decode('utf-8') if isinstance(s, str) else s)
+    try:
+        import json
+    except ImportError:
+        import simplejson as json
+    if str_keys:
+        return lambda s: json.loads(s, object_pairs_hook=_str_key_dict)
+    return json.loads
+
+def set_json_backend(name=None, str_keys=None):
+    """
+    Choose the JSON library that decodes API responses and analysis documents.
+    
+    Kwargs:
+        name (str): One of JSON_BACKENDS; None picks the fastest one installed (see JSON_BACKENDS)
+        
+        str_keys (bool): Decode object keys to str rather than unicode, so util.fix has nothing
+        left to rebuild; defaults to config.JSON_STR_KEYS. ujson cannot do this, so it raises
+        ValueError when asked for by name, and is passed over when picking automatically.
+    
+    Returns:
+        The name of the backend now in use
+    """
+    if str_keys is None:
+        str_keys = config.JSON_STR_KEYS
+    candidates = [name] if name else JSON_BACKENDS
+    for candidate in candidates:
+        try:
+            loads = _json_loads_for(candidate, str_keys, auto=not name)
+        except (ImportError, ValueError):
+            if name:
+                raise
+            continue
+        _json_decoder.update(name=candidate, loads=loads)
+        return candidate
+
+def get_json_backend():
+    """The name of the JSON library decoding API responses, e.g. 'simplejson'"""
+    if _json_decoder['loads'] is None:
+        set_json_backend(config.JSON_BACKEND)
+    return _json_decoder['name']
+
+def json_loads(s):
+    """Decode a JSON document with the selected backend (see set_json_backend)"""
+    loads = _json_decoder['loads']
+    if loads is None:
+        set_json_backend(config.JSON_BACKEND)
+        loads = _json_decoder['loads']
+    return loads(s)
+
+def _response_meta(f):
+    if hasattr(f, 'headers'):
+        headers = f.headers
     else:
         headers = {'Headers':'No Headers'}
-    if hasattr(raw_json, 'getcode'):
-        http_status = raw_json.getcode()
+    if hasattr(f, 'getcode'):
+        http_status = f.getcode()
     else:
         http_status = None
-    raw_json = raw_json.read()
+    return headers, http_status
+
+def get_successful_response(raw_json):
+    headers, http_status = _response_meta(raw_json)
+    return decode_response(raw_json.read(), headers, http_status)
+
+def decode_response(raw_json, headers=None, http_status=None):
+    """Decode a response body, raising EchoNestAPIError unless its status code is 0"""
     try:
-        response_dict = json.loads(raw_json)
+        response_dict = json_loads(raw_json)
         status_dict = response_dict['response']['status']
         code = int(status_dict['code'])
         message = status_dict['message']
@@ -126,148 +652,227 @@ def get_successful_response(raw_json):
         logger.debug(traceback.format_exc())
         raise EchoNestAPIError(-1, "Unknown error.", headers, http_status)
 
+HOOK_EVENTS = ('before_send', 'after_headers', 'after_body', 'after_decode', 'on_error')
+"""The points in a request's life a hook can be added at (see add_hook)"""
 
-def callm(method, param_dict, POST=False, socket_timeout=None, data=None):
+_hooks = dict((event, []) for event in HOOK_EVENTS)
+
+def add_hook(event, hook):
     """
-    Call the api! 
-    Param_dict is a *regular* *python* *dictionary* so if you want to have multi-valued params
-    put them in a list.
-    
-    ** note, if we require 2.6, we can get rid of this timeout munging.
+    Call hook(trace) at one point in the life of every request: API calls made by callm and oauthgetm,
+    analysis downloads and postChunked uploads. trace is the CallTrace for the request, the same object
+    at every point, so a hook may hang its own state (a tracing span, a profiler sample) on it.
+    Exceptions raised by hooks are logged, not passed on. Returns hook.
+
+    Args:
+        event (str): One of HOOK_EVENTS: 'before_send', 'after_headers' (the transport returned, so DNS,
+        connect and server time are behind us), 'after_body', 'after_decode' or 'on_error'
+
+        hook: A callable taking a CallTrace
+
+    Example:
+
+    >>> def slow(trace):
+    ...     if trace.timings['total'] > 1:
+    ...         print trace.method, trace.timings
+    >>> util.add_hook('after_decode', slow)
     """
-    try:
-        param_dict['api_key'] = config.ECHO_NEST_API_KEY
-        param_list = []
-        if not socket_timeout:
-            socket_timeout = config.CALL_TIMEOUT
-
-        for key,val in param_dict.iteritems():
-            if isinstance(val, list):
-                param_list.extend( [(key,subval) for subval in val] )
-            elif val is not None:
-                if isinstance(val, unicode):
-                    val = val.encode('utf-8')
-                param_list.append( (key,val) )
-
-        params = urllib.urlencode(param_list)
-
-        orig_timeout = socket.getdefaulttimeout()
-        socket.setdefaulttimeout(socket_timeout)
-
-        if(POST):
-            if (not method == 'track/upload') or ((method == 'track/upload') and 'url' in param_dict):
-                """
-                this is a normal POST call
-                """
-                url = 'http://%s/%s/%s/%s' % (config.API_HOST, config.API_SELECTOR,
-                                            config.API_VERSION, method)
-
-                if data is None:
-                    data = ''
-                data = urllib.urlencode(data)
-                data = "&".join([data, params])
-
-                f = opener.open(url, data=data)
-            else:
-                """
-                upload with a local file is special, as the body of the request is the content of the file,
-                and the other parameters stay on the URL
-                """
-                url = '/%s/%s/%s?%s' % (config.API_SELECTOR, config.API_VERSION,
-                                            method, params)
-
-                if ':' in config.API_HOST:
-                    host, port = config.API_HOST.split(':')
-                else:
-                    host = config.API_HOST
-                    port = 80
+    if event not in _hooks:
+        raise ValueError("Unknown hook event %r; expected one of %s" % (event, ', '.join(HOOK_EVENTS)))
+    _hooks[event].append(hook)
+    return hook
+
+def remove_hook(event, hook):
+    _hooks[event].remove(hook)
+
+def _fire(event, trace):
+    for hook in _hooks[event]:
+        try:
+            hook(trace)
+        except Exception:
+            logger.exception("%s hook %r failed" % (event, hook))
+
+class CallTrace(object):
+    """
+    What hooks are told about a request.
 
-                if config.TRACE_API_CALLS:
-                    logger.info("%s/%s" % (host+':'+str(port), url,))
-                conn = httplib.HTTPConnection(host, port = port)
-                conn.request('POST', url, body = data, headers = dict([('Content-Type', 'application/octet-stream')]+headers))
-                f = conn.getresponse()
+    Attributes:
+        method (str): The API method ('artist/profile'), 'track/analysis' for analysis downloads, or the
+        upload selector for postChunked
 
-        else:
-            """
-            just a normal GET call
-            """
-            url = 'http://%s/%s/%s/%s?%s' % (config.API_HOST, config.API_SELECTOR, config.API_VERSION,
-                                            method, params)
+        params (tuple): The sorted (key, value) params of the request without the API key
 
-            f = opener.open(url)
+        url (str): The URL requested
 
-        socket.setdefaulttimeout(orig_timeout)
+        timings (dict): Seconds spent in each finished phase: 'headers', 'body', 'decode', and 'total'
+        so far
 
-        # try/except
-        response_dict = get_successful_response(f)
-        return response_dict
+        response_size (int): Bytes in the response body as sent, so compressed if it was; once read
 
-    except IOError, e:
-        if hasattr(e, 'reason'):
-            raise EchoNestIOError(error=e.reason)
-        elif hasattr(e, 'code'):
-            raise EchoNestIOError(code=e.code)
-        else:
-            raise
+        content_encoding (str): 'gzip' or 'deflate' for a compressed response, once headers are in
 
-def oauthgetm(method, param_dict, socket_timeout=None):
+        http_status (int): The HTTP status, once headers are in
+
+        error (Exception): What went wrong, for on_error hooks
+    """
+    def __init__(self, method, params, url):
+        self.method = method
+        self._params = params
+        self._normalized = False
+        self.url = url
+        self.timings = {'total': 0.0}
+        self.response_size = None
+        self.content_encoding = None
+        self.http_status = None
+        self.error = None
+        self.start = self._last = time.time()
+
+    @property
+    def params(self):
+        # normalized on first use, so calls nobody hooks into don't pay for it
+        if not self._normalized:
+            self._params = tuple((k, v) for (k, v) in normalize_params(self._params or {}) if k != 'api_key')
+            self._normalized = True
+        return self._params
+
+    def _phase(self, name):
+        now = time.time()
+        self.timings[name] = now - self._last
+        self.timings['total'] = now - self.start
+        self._last = now
+
+    def __repr__(self):
+        return "<CallTrace - %s>" % self.method
+
+_READ_CHUNK = 65536
+
+def response_header(f, name):
+    """The value of header name (case-insensitive) in response f, or None"""
+    headers = getattr(f, 'headers', None)
+    return headers.get(name.lower()) if hasattr(headers, 'get') else None
+
+def _content_encoding(f):
+    encoding = (response_header(f, 'content-encoding') or '').strip().lower()
+    return 'gzip' if encoding == 'x-gzip' else encoding if encoding in ('gzip', 'deflate') else None
+
+def _read_body(f, encoding):
+    """
+    The body of response f and its size on the wire. A gzip or deflate body is decompressed a chunk
+    at a time as it arrives, so the compressed copy is never held whole. A body that does not
+    decompress raises EchoNestAPIError with code -1.
+    """
+    if encoding is None:
+        raw = f.read()
+        return raw, len(raw)
+    chunks = []
+    size = 0
+    decompressor = None
     try:
-        import oauth2 # lazy import this so oauth2 is not a hard dep
-    except ImportError:
-        raise Exception("You must install the python-oauth2 library to use this method.")
+        while True:
+            chunk = f.read(_READ_CHUNK)
+            if not chunk:
+                break
+            size += len(chunk)
+            if decompressor is None:
+                if encoding == 'gzip':
+                    wbits = 16 + zlib.MAX_WBITS
+                elif (len(chunk) > 1 and ord(chunk[0]) & 0x0f == 8 and
+                      ((ord(chunk[0]) << 8) | ord(chunk[1])) % 31 == 0):
+                    # a zlib header: compression method 8 (deflate) and a valid check value
+                    wbits = zlib.MAX_WBITS
+                else:
+                    # some servers send raw deflate data without the zlib header
+                    wbits = -zlib.MAX_WBITS
+                decompressor = zlib.decompressobj(wbits)
+            chunks.append(decompressor.decompress(chunk))
+        if decompressor is not None:
+            chunks.append(decompressor.flush())
+    except zlib.error, e:
+        raise EchoNestAPIError(-1, "Could not decompress the %s response: %s" % (encoding, e),
+                               getattr(f, 'headers', None), f.getcode() if hasattr(f, 'getcode') else None)
+    return ''.join(chunks), size
+
+def _current_transport():
+    # the transport of the current client, which is util.transport unless one was given to it
+    import client
+    return client.get_client().transport
+
+def _exchange(method, url, data=None, headers=None, params=None, decode=None, raise_for_status=False, open_url=None):
+    # every request goes through here: the transport, decoding, hooks and metrics in one place
+    trace = CallTrace(method, params, url)
+    _fire('before_send', trace)
+    bytes_out = len(url) + (len(data) if isinstance(data, basestring) else 0)
+    if config.ACCEPT_ENCODING:
+        headers = dict(headers or {})
+        headers.setdefault('Accept-Encoding', config.ACCEPT_ENCODING)
+    try:
+        f = (open_url or _current_transport().open)(url, data, headers)
+        trace.http_status = f.getcode() if hasattr(f, 'getcode') else None
+        trace.content_encoding = _content_encoding(f)
+        trace._phase('headers')
+        _fire('after_headers', trace)
+        if raise_for_status and trace.http_status is not None and trace.http_status >= 400:
+            raise urllib2.HTTPError(url, trace.http_status, 'HTTP Error %d' % trace.http_status, f.headers, None)
+        raw, trace.response_size = _read_body(f, trace.content_encoding)
+        trace._phase('body')
+        _fire('after_body', trace)
+        result = decode(raw, f) if decode is not None else raw
+        if decode is not None:
+            trace._phase('decode')
+            _fire('after_decode', trace)
+    except Exception, e:
+        trace.error = e
+        trace._phase('error')
+        _fire('on_error', trace)
+        if isinstance(e, EchoNestAPIError):
+            code = e.code
+        elif isinstance(e, (IOError, httplib.HTTPException)):
+            code = getattr(e, 'code', None) or 'io'
+        else:
+            code = e.__class__.__name__
+        metrics.observe_call(method, trace.timings['total'], bytes_out, trace.response_size or 0, code)
+        raise
+    metrics.observe_call(method, trace.timings['total'], bytes_out, trace.response_size)
+    return result
+
+def _decode_api_response(raw_json, f):
+    return decode_response(raw_json, *_response_meta(f))
+
+def _send(method, url, data=None, headers=None, params=None, ledger=None, open_url=None, decode=None):
+    (ledger or quota).charge(method, (params or {}).get('api_key'))
+    return _exchange(method, url, data, headers, params, decode=decode or _decode_api_response, open_url=open_url)
+
+def download(url, method='track/analysis', decode=None):
+    """
+    Fetch a document that is not an API response (an analysis_url) through the current client's
+    transport (util.transport by default), with the same hooks and metrics as API calls. Raises
+    urllib2.HTTPError for an HTTP error status.
+
+    Kwargs:
+        method (str): The name the download is reported under
+
+        decode: A function of the body, e.g. util.json_loads; the body is returned as is when None
+    """
+    return _exchange(method, url, decode=(lambda raw, f: decode(raw)) if decode else None, raise_for_status=True)
+
 
+def callm(method, param_dict, POST=False, socket_timeout=None, data=None):
     """
-    Call the api! With Oauth! 
+    Call the api! 
     Param_dict is a *regular* *python* *dictionary* so if you want to have multi-valued params
     put them in a list.
-    
-    ** note, if we require 2.6, we can get rid of this timeout munging.
+
+    The call is made by the current client (see client.get_client), which by default reads config.
     """
-    def build_request(url):
-        params = {
-            'oauth_version': "1.0",
-            'oauth_nonce': oauth2.generate_nonce(),
-            'oauth_timestamp': int(time.time())
-            }
-        consumer = oauth2.Consumer(key=config.ECHO_NEST_CONSUMER_KEY, secret=config.ECHO_NEST_SHARED_SECRET)
-        params['oauth_consumer_key'] = config.ECHO_NEST_CONSUMER_KEY
-        
-        req = oauth2.Request(method='GET', url=url, parameters=params)
-        signature_method = oauth2.SignatureMethod_HMAC_SHA1()
-        req.sign_request(signature_method, consumer, None)
-        return req
-    
-    param_dict['api_key'] = config.ECHO_NEST_API_KEY
-    param_list = []
-    if not socket_timeout:
-        socket_timeout = config.CALL_TIMEOUT
-    
-    for key,val in param_dict.iteritems():
-        if isinstance(val, list):
-            param_list.extend( [(key,subval) for subval in val] )
-        elif val is not None:
-            if isinstance(val, unicode):
-                val = val.encode('utf-8')
-            param_list.append( (key,val) )
+    import client
+    return client.get_client().callm(method, param_dict, POST, socket_timeout, data)
 
-    params = urllib.urlencode(param_list)
-    
-    orig_timeout = socket.getdefaulttimeout()
-    socket.setdefaulttimeout(socket_timeout)
+def oauthgetm(method, param_dict, socket_timeout=None):
     """
-    just a normal GET call
+    Call the api! With Oauth! The call is made by the current client (see client.get_client).
     """
-    url = 'http://%s/%s/%s/%s?%s' % (config.API_HOST, config.API_SELECTOR, config.API_VERSION, 
-                                     method, params)
-    req = build_request(url)
-    f = opener.open(req.to_url())
-            
-    socket.setdefaulttimeout(orig_timeout)
-    
-    # try/except
-    response_dict = get_successful_response(f)
-    return response_dict
+    import client
+    return client.get_client().oauthgetm(method, param_dict, socket_timeout)
 
 
 def postChunked(host, selector, fields, files):
@@ -286,16 +891,68 @@ def postChunked(host, selector, fields, files):
     """
     params = urllib.urlencode(fields)
     url = 'http://%s%s?%s' % (host, selector, params)
-    u = urllib2.urlopen(url, files)
-    result = u.read()
+    result = _exchange(selector, url, files, params=fields,
+                       open_url=lambda url, data, headers: urllib2.urlopen(url, data))
     [fp.close() for (key, fp) in files]
     return result
 
+def _start_page(fetch, start, results):
+    holder = {}
+    def run():
+        try:
+            holder['page'] = fetch(start, results)
+        except Exception:
+            holder['error'] = sys.exc_info()
+    return start_thread(run, 'page-%d' % start), holder
+
+def _finish_page(pending):
+    thread, holder = pending
+    thread.join()
+    if 'error' in holder:
+        exc_type, exc_value, exc_tb = holder['error']
+        raise exc_type, exc_value, exc_tb
+    return holder['page']
+
+def paginate(fetch, page_size=15, start=0, prefetch=1):
+    """
+    Walk every item of a paged API result, yielding one item at a time.
+    
+    fetch(start, results) is called once per page and should return a ResultList; a plain list
+    (no total) ends the iteration at the first short page. Up to prefetch pages beyond the one being
+    read are fetched concurrently in background threads, and nothing more is requested once the
+    consumer stops iterating.
+    """
+    offset = start
+    scheduled = start
+    pending = collections.deque()
+    page = fetch(start, page_size)
+    while True:
+        total = getattr(page, 'total', None)
+        last = len(page) < page_size or (total is not None and offset + len(page) >= total)
+        if not last:
+            while len(pending) < prefetch and (total is None or scheduled + page_size < total):
+                scheduled += page_size
+                pending.append(_start_page(fetch, scheduled, page_size))
+        for item in page:
+            yield item
+        if last:
+            return
+        offset += page_size
+        if pending:
+            page = _finish_page(pending.popleft())
+        else:
+            scheduled = offset
+            page = fetch(offset, page_size)
+
 
 def fix(x):
     # we need this to fix up all the dict keys to be strings, not unicode objects
     assert(isinstance(x,dict))
-    return dict((str(k), v) for (k,v) in x.iteritems())
+    for k in x:
+        if type(k) is not str:
+            return dict((str(k), v) for (k,v) in x.iteritems())
+    # the decoder already gave us str keys (see set_json_backend), nothing to rebuild
+    return x
 
 
 def map_idspace(input_idspace):
@@ -1,11 +1,10 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
-__version__ = "9.0.0"
-
 # $Source$
 from sys import version
 import os
+import re
 from setuptools import setup
 
 if version < '2.6':
@@ -19,6 +18,9 @@ else:
 def read(fname):
     return open(os.path.join(os.path.dirname(__file__), fname)).read()
 
+# the version is kept in one place, pyechonest/config.py
+__version__ = re.search(r'^__version__ = "([^"]+)"', read(os.path.join('pyechonest', 'config.py')), re.M).group(1)
+
 setup(
     name='pyechonest',
     version=__version__,